@@ -0,0 +1,58 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "src")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+class NullGamepad:
+    """Stands in for vg.VX360Gamepad so benchmarks measure our code, not the ViGEm driver."""
+    def __init__(self):
+        self.updates = 0
+
+    def press_button(self, button):
+        pass
+
+    def release_button(self, button):
+        pass
+
+    def left_trigger_float(self, value_float):
+        pass
+
+    def right_trigger_float(self, value_float):
+        pass
+
+    def left_joystick_float(self, x_value_float, y_value_float):
+        pass
+
+    def right_joystick_float(self, x_value_float, y_value_float):
+        pass
+
+    def update(self):
+        self.updates += 1
+
+    def reset(self):
+        pass
+
+
+def _install_vgamepad_stub():
+    #vgamepad needs ViGEm (Windows) or uinput (Linux); benchmarks only need its button enum
+    try:
+        import vgamepad  # noqa: F401
+        return
+    except Exception:
+        pass
+    import enum
+    import types
+
+    stub = types.ModuleType("vgamepad")
+    names = ["DPAD_UP", "DPAD_DOWN", "DPAD_LEFT", "DPAD_RIGHT", "START", "BACK", "LEFT_THUMB", "RIGHT_THUMB",
+             "LEFT_SHOULDER", "RIGHT_SHOULDER", "GUIDE", "A", "B", "X", "Y"]
+    stub.XUSB_BUTTON = enum.IntFlag("XUSB_BUTTON", {f"XUSB_GAMEPAD_{n}": 1 << i for i, n in enumerate(names)})
+    stub.VX360Gamepad = NullGamepad
+    sys.modules["vgamepad"] = stub
+
+
+_install_vgamepad_stub()
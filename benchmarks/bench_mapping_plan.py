@@ -0,0 +1,134 @@
+"""Compares the compiled MappingPlan against the old per-frame mapping interpreter.
+
+Usage: python benchmarks/bench_mapping_plan.py [--frames N]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from _support import NullGamepad
+from src.InputFrame import InputFrame
+from src.XboxMapper.GamepadManager import GamepadManager
+from src.XboxMapper.Mapper import GAMEPAD_ACTIONS, apply_control
+
+BUTTON_ACTIONS = [name for name, (kind, _target) in GAMEPAD_ACTIONS.items() if kind.value == "button"]
+
+
+def legacy_resolve_input(mapping, inputs):
+    if isinstance(mapping, list):
+        return sum(legacy_resolve_input(m, inputs) or 0.0 for m in mapping)
+    if mapping is None:
+        return None
+    raw = inputs.get(mapping["input"])
+    if raw is None:
+        return None
+    if mapping["input"].startswith("toggle:"):
+        return mapping.get("value", 1.0) if raw else 0.0
+    scale = mapping.get("scale", 1.0)
+    return -float(raw) / scale
+
+
+def legacy_update_state(gamepad, mapping, inputs):
+    #The interpreter GamepadManager.update_state ran before mappings were compiled
+    for side in ("left", "right"):
+        joystick_cfg = mapping.get(f"{side}_joystick")
+        if not joystick_cfg:
+            continue
+        x = legacy_resolve_input(joystick_cfg.get("x"), inputs) or 0.0
+        y = legacy_resolve_input(joystick_cfg.get("y"), inputs) or 0.0
+        apply_control(gamepad, f"{side}_joystick", x=x, y=y)
+    for side in ("left", "right"):
+        trigger_cfg = mapping.get(f"{side}_trigger")
+        if not trigger_cfg:
+            continue
+        value = legacy_resolve_input(trigger_cfg, inputs) or 0.0
+        apply_control(gamepad, f"{side}_trigger", value=value)
+    for action_name, button_cfg in mapping.items():
+        if action_name.endswith("_joystick") or action_name.endswith("_trigger"):
+            continue
+        if not button_cfg:
+            continue
+        if isinstance(button_cfg, list):
+            pressed = any(inputs.get(cfg["input"]) for cfg in button_cfg)
+        else:
+            pressed = bool(inputs.get(button_cfg["input"]))
+        apply_control(gamepad, action_name, pressed=bool(pressed))
+    gamepad.update()
+
+
+def make_mapping(phone_buttons, inputs_per_action):
+    names = [f"toggle:b{i}" for i in range(phone_buttons)]
+    rng = random.Random(1)
+    mapping = {}
+    for action in BUTTON_ACTIONS:
+        mapping[action] = [{"input": rng.choice(names)} for _ in range(inputs_per_action)]
+    for side in ("left", "right"):
+        mapping[f"{side}_trigger"] = [{"input": rng.choice(names), "value": 0.5} for _ in range(inputs_per_action)]
+        mapping[f"{side}_joystick"] = {
+            "x": [{"input": "float:pitch", "scale": 1.5708}] + [{"input": rng.choice(names), "value": 0.25}],
+            "y": [{"input": "float:roll", "scale": 1.5708}],
+        }
+    return mapping
+
+
+def make_frames(phone_buttons, count, changes_per_frame):
+    rng = random.Random(2)
+    pressed = [False] * phone_buttons
+    pitch = roll = 0.0
+    frames = []
+    for _ in range(count):
+        for _ in range(changes_per_frame):
+            i = rng.randrange(phone_buttons)
+            pressed[i] = not pressed[i]
+        if rng.random() < 0.3:
+            pitch = round(rng.uniform(-1.5, 1.5), 2)
+            roll = round(rng.uniform(-1.5, 1.5), 2)
+        inputs = {f"toggle:b{i}": p for i, p in enumerate(pressed)}
+        inputs["toggle:stepping"] = False
+        inputs["float:pitch"] = pitch
+        inputs["float:roll"] = roll
+        frames.append(InputFrame(inputs))
+    return frames
+
+
+def run_case(label, phone_buttons, inputs_per_action, frame_count):
+    mapping = make_mapping(phone_buttons, inputs_per_action)
+    frames = make_frames(phone_buttons, frame_count, changes_per_frame=2)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".cfg", delete=False) as f:
+        json.dump(mapping, f)
+        config_path = f.name
+    manager = GamepadManager(config_path, gamepad=NullGamepad())
+    os.remove(config_path)
+
+    gamepad = NullGamepad()
+    start = time.perf_counter()
+    for frame in frames:
+        legacy_update_state(gamepad, mapping, frame.inputs)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for frame in frames:
+        manager.update_state(frame)
+    compiled = time.perf_counter() - start
+
+    print(f"{label:<28} legacy {legacy / frame_count * 1e6:8.2f} us/frame   "
+          f"compiled {compiled / frame_count * 1e6:8.2f} us/frame   x{legacy / compiled:5.1f}   "
+          f"driver updates {manager.updates_issued} issued / {manager.updates_skipped} skipped")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=20000)
+    args = parser.parse_args()
+
+    run_case("small (8 buttons, 1 each)", 8, 1, args.frames)
+    run_case("medium (32 buttons, 4 each)", 32, 4, args.frames)
+    run_case("large (128 buttons, 16 each)", 128, 16, args.frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Replays a synthetic session at max speed through GamepadManager and SocketHandler, frames per second end to end.
+
+Usage: python benchmarks/bench_replay.py [--frames N] [--clients N] [--session PATH]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import types
+
+from _support import NullGamepad
+from bench_mapping_plan import make_mapping
+from src.ClientQueue import ClientQueue
+from src.InputProtocol import encode_frame
+from src.SessionLog import KIND_PAUSE, SessionRecorder, read_session
+from src.SessionReplay import SessionReplay
+from src.SocketHandler import SocketHandler
+from src.XboxMapper.GamepadManager import GamepadManager
+
+BUTTONS = 32
+
+
+def record_session(path, frames, binary):
+    rng = random.Random(3)
+    names = [f"b{i}" for i in range(BUTTONS)]
+    pressed = [False] * BUTTONS
+    recorder = SessionRecorder(path, names if binary else None)
+    for i in range(frames):
+        pressed[rng.randrange(BUTTONS)] ^= True
+        pitch, roll = rng.uniform(-1.5, 1.5), rng.uniform(-1.5, 1.5)
+        at = i / 100
+        if binary:
+            recorder.input_binary(encode_frame(pressed, pitch, roll, False), at)
+        else:
+            recorder.input_json(json.dumps({
+                "buttons": [{"name": n, "pressed": p} for n, p in zip(names, pressed)],
+                "stepping": False, "pitch": pitch, "roll": roll,
+            }), at)
+        if i % 500 == 0:
+            recorder.event(KIND_PAUSE, at)
+    recorder.close()
+
+
+def make_targets(clients):
+    with tempfile.NamedTemporaryFile("w", suffix=".cfg", delete=False) as f:
+        json.dump(make_mapping(BUTTONS, 4), f)
+        config_path = f.name
+    manager = GamepadManager(config_path, gamepad=NullGamepad())
+    os.remove(config_path)
+
+    socket_handler = SocketHandler(types.SimpleNamespace())
+    for i in range(clients):
+        socket_handler.clients[i] = ClientQueue(capacity=1 << 20)
+    return manager, socket_handler
+
+
+async def run_case(label, records, clients):
+    manager, socket_handler = make_targets(clients)
+    replay = SessionReplay(manager, socket_handler, speed=0)
+    await replay.play(records)
+    stats = replay.stats()
+    print(f"{label:<28} {stats['frames']:>7} frames  {stats['elapsed_s']:7.3f} s  {stats['frames_per_s']:>9} frames/s   "
+          f"driver updates {manager.updates_issued} issued / {manager.updates_skipped} skipped")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--session", help="replay a recorded session instead of the synthetic ones")
+    args = parser.parse_args()
+
+    if args.session:
+        await run_case(os.path.basename(args.session), list(read_session(args.session)), args.clients)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for binary in (False, True):
+            path = os.path.join(tmp, "binary.blesession" if binary else "json.blesession")
+            record_session(path, args.frames, binary)
+            label = f"{'binary' if binary else 'json'} frames, {args.clients} clients"
+            await run_case(label, list(read_session(path)), args.clients)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
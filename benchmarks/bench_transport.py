@@ -0,0 +1,106 @@
+"""Runs the real DeviceBLE stack against SimulatedPeripheral: send_file throughput and input notification rate.
+
+Usage: python benchmarks/bench_transport.py [--kb N] [--frames N] [--pps N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from _support import NullGamepad
+from src.ClientQueue import ClientQueue
+from src.DeviceBLE import DeviceBLE
+from src.FileTransfer import FEATURE_HASH, FEATURE_SEQ, FEATURE_ZLIB
+from src.SimulatedPeripheral import SimulatedPeripheral
+
+
+async def connect(peripheral):
+    device = DeviceBLE(client_factory=peripheral.client_factory)
+    device.gamepadManager.stop_output_scheduler()
+    device.gamepadManager.gamepad = NullGamepad()
+    device.address = "SIMULATED"
+    await device.connect()
+    await device.notify()
+    #Let the PROTO and XFER replies arrive
+    await asyncio.sleep(max(0.01, peripheral.latency * 2))
+    return device
+
+
+def make_layout(kb):
+    #Layout-like JSON so compression behaves as it does on real files
+    rng = random.Random(4)
+    widgets = []
+    while len(json.dumps(widgets)) < kb * 1024:
+        widgets.append({"type": rng.choice(["button", "joystick", "slider"]), "name": f"Button {len(widgets)}",
+                        "x": rng.randrange(1920), "y": rng.randrange(1080), "w": 120, "h": 120, "color": "#3a7bd5"})
+    return json.dumps(widgets).encode("utf-8")
+
+
+async def transfer_case(label, path, size, features, args, loss=0.0, mtu=247):
+    peripheral = SimulatedPeripheral(mtu=mtu, packets_per_second=args.pps, loss=loss, features=features)
+    device = await connect(peripheral)
+    start = time.perf_counter()
+    await device.send_file(path)
+    elapsed = time.perf_counter() - start
+    ok = peripheral.files.get(os.path.basename(path)) is not None
+    print(f"{label:<34} {elapsed:7.3f} s  {size / 1024 / elapsed:9.1f} KB/s   {peripheral.packets_written:>6} writes"
+          f"  {peripheral.packets_lost:>5} lost  {peripheral.bytes_written / 1024:8.1f} KB on air  {'ok' if ok else 'FAILED'}")
+    await device.disconnect()
+
+
+async def input_case(label, frames, binary, clients, rate_hz):
+    names = [f"Button {i}" for i in range(16)] if binary else None
+    peripheral = SimulatedPeripheral(button_names=names)
+    device = await connect(peripheral)
+    for i in range(clients):
+        device.socketHandler.clients[i] = ClientQueue(capacity=1 << 20)
+    rng = random.Random(5)
+    pressed = [False] * 16
+    packets = []
+    for _ in range(frames):
+        pressed[rng.randrange(16)] ^= True
+        packets.append(peripheral.input_packets(list(pressed), rng.uniform(-1.5, 1.5), rng.uniform(-1.5, 1.5)))
+
+    seen = []
+    device.add_input_consumer(seen.append)
+    start = time.perf_counter()
+    await peripheral.stream_inputs(packets, rate_hz)
+    await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {len(seen):>7} frames  {elapsed:7.3f} s  {len(seen) / elapsed:9.0f} frames/s   "
+          f"driver updates {device.gamepadManager.updates_issued}")
+    await device.disconnect()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--kb", type=int, default=256)
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--pps", type=int, default=None, help="writes without response per second, default unthrottled")
+    args = parser.parse_args()
+
+    data = make_layout(args.kb)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "layout.json")
+        with open(path, "wb") as f:
+            f.write(data)
+        await transfer_case("legacy", path, len(data), (), args)
+        await transfer_case("seq", path, len(data), (FEATURE_SEQ,), args)
+        await transfer_case("seq + zlib", path, len(data), (FEATURE_SEQ, FEATURE_ZLIB), args)
+        await transfer_case("seq, mtu 517", path, len(data), (FEATURE_SEQ,), args, mtu=517)
+        await transfer_case("seq, 2% loss", path, len(data), (FEATURE_SEQ,), args, loss=0.02)
+        await transfer_case("seq + zlib + hash, 2% loss", path, len(data), (FEATURE_SEQ, FEATURE_ZLIB, FEATURE_HASH), args,
+                            loss=0.02)
+
+    from src.config import emulation_state
+    emulation_state.enabled = True
+    await input_case("json input, 4 clients", args.frames, False, 4, None)
+    await input_case("binary input, 4 clients", args.frames, True, 4, None)
+    await input_case("binary input at 500 Hz", min(args.frames, 2000), True, 4, 500)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
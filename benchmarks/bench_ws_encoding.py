@@ -0,0 +1,54 @@
+"""Bytes on the wire and encode time per websocket message type, JSON against msgpack/binary frames.
+
+Usage: python benchmarks/bench_ws_encoding.py [--iterations N] [--photo-kb N]
+"""
+import argparse
+import json
+import os
+import time
+
+import _support  # noqa: F401
+from src.InputFrame import InputFrame
+from src.WireFormat import PhotoResponse, msgpack
+
+
+def make_frame():
+    inputs = {f"toggle:Button {i}": i % 3 == 0 for i in range(8)}
+    inputs["toggle:stepping"] = True
+    inputs["float:pitch"] = 0.42317
+    inputs["float:roll"] = -1.13271
+    return InputFrame(inputs)
+
+
+def measure(label, build, encode, iterations):
+    #Each iteration builds a fresh message so the per-object encode caches do not hide the cost
+    messages = [build() for _ in range(iterations)]
+    start = time.perf_counter()
+    for message in messages:
+        payload = encode(message)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {len(payload):>9} bytes   {elapsed / iterations * 1e6:9.2f} us/message")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--photo-kb", type=int, default=512)
+    args = parser.parse_args()
+
+    measure("input json", make_frame, InputFrame.to_json, args.iterations)
+    if msgpack is not None:
+        measure("input msgpack", make_frame, InputFrame.to_msgpack, args.iterations)
+    else:
+        print("input msgpack            skipped, msgpack is not installed")
+
+    photo = os.urandom(args.photo_kb * 1024)
+    photo_iterations = max(1, args.iterations // 200)
+    measure("photo json (base64)", lambda: PhotoResponse(photo, True), PhotoResponse.to_json, photo_iterations)
+    measure("photo binary frame", lambda: PhotoResponse(photo, True), PhotoResponse.to_binary, photo_iterations)
+
+    measure("event json", lambda: {"type": "pause"}, json.dumps, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""Hot path benchmark suite with stored baselines.
+
+Every case reports operations per second (best of --repeat runs). Results are compared against
+benchmarks/baseline.json and the run exits with status 1 if any case is more than --threshold
+percent slower, so it can gate a PR. Baselines are machine specific and not committed: record
+them on the machine that runs the check with --save-baseline, from the base branch, before
+measuring a change. Cases without a baseline are reported as such, --require-baseline fails the
+run on them so a gate cannot silently pass.
+
+Usage: python benchmarks/run.py [--only NAME ...] [--threshold PCT] [--json OUT] [--save-baseline]
+                                [--require-baseline] [--quick]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from _support import ROOT, NullGamepad
+from bench_mapping_plan import make_mapping
+from PIL import Image
+from src.ClientQueue import ClientQueue
+from src.DeviceBLE import DeviceBLE
+from src.FileTransfer import CRC32, build_blocks
+from src.GPX.GPXManager import GPXManager
+from src.GPX.ScreenshotHelper import jpeg_with_exif
+from src.InputFrame import InputFrame, toggle_keys
+from src.InputProtocol import encode_frame
+from src.SimulatedPeripheral import SimulatedPeripheral
+from src.SocketHandler import SocketHandler
+from src.XboxMapper.GamepadManager import GamepadManager
+from src.XboxMapper.MacroEngine import TimerWheel
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+BUTTONS = 16
+
+
+def _frames(count, buttons=BUTTONS):
+    rng = random.Random(6)
+    pressed = [False] * buttons
+    frames = []
+    for _ in range(count):
+        pressed[rng.randrange(buttons)] ^= True
+        frames.append((list(pressed), round(rng.uniform(-1.5, 1.5), 4), round(rng.uniform(-1.5, 1.5), 4)))
+    return frames
+
+
+def _json_frame(pressed, pitch, roll):
+    return json.dumps({"buttons": [{"name": f"Button {i}", "pressed": p} for i, p in enumerate(pressed)],
+                       "stepping": False, "pitch": pitch, "roll": roll})
+
+
+#Each case returns (operations per call, callable); the suite times the callable
+
+def case_decode_json():
+    texts = [_json_frame(*f) for f in _frames(1000)]
+
+    def run():
+        for text in texts:
+            InputFrame.from_json(text)
+    return len(texts), run
+
+
+def case_decode_binary():
+    packets = [encode_frame(*f, False) for f in _frames(1000)]
+    keys = toggle_keys(f"Button {i}" for i in range(BUTTONS))
+
+    def run():
+        for data in packets:
+            InputFrame.from_binary(data, keys)
+    return len(packets), run
+
+
+def _update_state_case(phone_buttons, inputs_per_action, filters=None):
+    mapping = make_mapping(phone_buttons, inputs_per_action)
+    if filters:
+        mapping["filters"] = filters
+    with tempfile.NamedTemporaryFile("w", suffix=".cfg", delete=False) as f:
+        json.dump(mapping, f)
+        config_path = f.name
+    manager = GamepadManager(config_path, gamepad=NullGamepad())
+    os.remove(config_path)
+    frames = []
+    for pressed, pitch, roll in _frames(1000, phone_buttons):
+        inputs = {f"toggle:b{i}": p for i, p in enumerate(pressed)}
+        inputs["toggle:stepping"] = False
+        inputs["float:pitch"] = pitch
+        inputs["float:roll"] = roll
+        frames.append(InputFrame(inputs))
+
+    def run():
+        for frame in frames:
+            manager.update_state(frame)
+    return len(frames), run
+
+
+def case_update_state_small():
+    return _update_state_case(8, 1)
+
+
+def case_update_state_huge():
+    return _update_state_case(128, 16)
+
+
+def case_update_state_filtered():
+    smoothing = {"type": "one_euro", "min_cutoff": 1.0, "beta": 0.05}
+    return _update_state_case(8, 1, {
+        "float:pitch": {"smoothing": smoothing, "deadzone": 0.05, "curve": 1.5, "quantize": 0.01},
+        "float:roll": {"smoothing": smoothing, "deadzone": 0.05, "quantize": 0.01},
+    })
+
+
+class _NoDevice:
+    pass
+
+
+def _fanout_case(clients):
+    socket_handler = SocketHandler(_NoDevice())
+    for i in range(clients):
+        socket_handler.clients[i] = ClientQueue(capacity=1 << 20)
+    frames = [InputFrame.from_json(_json_frame(*f)) for f in _frames(1000)]
+    queues = list(socket_handler.clients.values())
+
+    def run():
+        for frame in frames:
+            #What the sender tasks do per client, minus the socket write
+            socket_handler.on_input_frame(frame)
+            for client_queue in queues:
+                socket_handler.encode_for(client_queue, frame)
+        for client_queue in queues:
+            client_queue._items.clear()
+    return len(frames), run
+
+
+def case_fanout_1():
+    return _fanout_case(1)
+
+
+def case_fanout_4():
+    return _fanout_case(4)
+
+
+def case_fanout_16():
+    return _fanout_case(16)
+
+
+def case_chunk_reassembly():
+    device = DeviceBLE()
+    device.gamepadManager.stop_output_scheduler()
+    device.input_consumers = []
+    peripheral = SimulatedPeripheral(mtu=64)
+    packets = [packet for f in _frames(500) for packet in peripheral.input_packets(*f)]
+
+    def run():
+        for data in packets:
+            device.input_handler(None, data)
+    return 500, run
+
+
+def case_crc_chunking():
+    data = random.Random(7).randbytes(256 * 1024)
+
+    def run():
+        CRC32(data)
+        build_blocks(data, 244)
+    #Operations are megabytes processed
+    return len(data) / (1024 * 1024), run
+
+
+def case_gpx_append():
+    random.seed(8)
+
+    def run():
+        manager = GPXManager(51.5, -0.12)
+        for _ in range(1000):
+            manager.on_step()
+    return 1000, run
+
+
+def case_exif_encode():
+    buffer = io.BytesIO()
+    Image.effect_noise((640, 360), 40).convert("RGB").save(buffer, "PNG")
+    png = buffer.getvalue()
+
+    def run():
+        jpeg_with_exif(png, 51.5, -0.12)
+    return 1, run
+
+
+def case_timer_wheel():
+    #Hundreds of turbo and macro timers in flight, scheduled and expired without the engine thread
+    delays = [random.Random(9).randint(1, 400) for _ in range(1000)]
+
+    def run():
+        wheel = TimerWheel()
+        for delay in delays:
+            wheel.add(wheel.current + delay, None)
+        while wheel.pending:
+            wheel.advance(wheel.current + 1)
+    return len(delays), run
+
+
+CASES = {
+    "decode_json": case_decode_json,
+    "decode_binary": case_decode_binary,
+    "update_state_small": case_update_state_small,
+    "update_state_huge": case_update_state_huge,
+    "update_state_filtered": case_update_state_filtered,
+    "fanout_1": case_fanout_1,
+    "fanout_4": case_fanout_4,
+    "fanout_16": case_fanout_16,
+    "chunk_reassembly": case_chunk_reassembly,
+    "crc_chunking": case_crc_chunking,
+    "gpx_append": case_gpx_append,
+    "exif_encode": case_exif_encode,
+    "timer_wheel": case_timer_wheel,
+}
+
+
+def measure(case, repeat, min_time):
+    operations, run = case()
+    run()   # warm caches and lazily built state
+    best = 0.0
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, operations * calls / elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timed run")
+    parser.add_argument("--threshold", type=float, default=15.0, help="percent slowdown that fails the run")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--require-baseline", action="store_true", help="fail when a case has no baseline")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--quick", action="store_true", help="one short run per case, for smoke testing")
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat, args.min_time = 1, 0.05
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        baseline = {}
+
+    results = {}
+    regressions = []
+    missing = []
+    for name in args.only or CASES:
+        ops = measure(CASES[name], args.repeat, args.min_time)
+        results[name] = round(ops, 1)
+        line = f"{name:<22} {ops:14.1f} ops/s"
+        if name in baseline:
+            change = (ops - baseline[name]) / baseline[name] * 100
+            line += f"   baseline {baseline[name]:14.1f}   {change:+6.1f}%"
+            if change < -args.threshold:
+                regressions.append(name)
+                line += "   REGRESSION"
+        else:
+            missing.append(name)
+            line += "   NO BASELINE"
+        print(line, flush=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "regressions": regressions, "missing_baseline": missing,
+                       "threshold_pct": args.threshold}, f, indent=2)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    failed = False
+    if missing:
+        print(f"{len(missing)} case(s) have no baseline in {args.baseline}, run with --save-baseline on the base "
+              f"branch first: {', '.join(missing)}")
+        failed = args.require_baseline
+    if regressions:
+        print(f"{len(regressions)} case(s) more than {args.threshold}% slower than baseline: {', '.join(regressions)}")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import deque
+
+from src.WireFormat import ENCODING_JSON
+
+# What happens when a client's buffer is full:
+# DROP_OLDEST discards the oldest queued message (input telemetry, only the latest matters)
+# BLOCK makes the producer wait for the client to catch up (photo and gpx responses must arrive)
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+
+class ClientQueue:
+    """Bounded outgoing buffer for one websocket client, with lag and drop counters.
+
+    Messages put with BLOCK wait in their own lane, which get() drains first, so telemetry pushed
+    into a full queue can never evict them.
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._items = deque()
+        self._responses = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self.closed = False
+        #Set by the client's subscribe message, None means every topic
+        self.topics = None
+        self.min_input_interval = 0.0
+        self.last_input_at = 0.0
+        #Set by the client's hello message
+        self.encoding = ENCODING_JSON
+        self.binary_images = False
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def wants(self, topic):
+        return self.topics is None or topic in self.topics
+
+    def push(self, message):
+        #Never waits, used from BLE callbacks; makes room by dropping the oldest telemetry message
+        if len(self._items) >= self.capacity:
+            self._items.popleft()
+            self.dropped += 1
+        self._append(message)
+
+    async def put(self, message, policy=BLOCK):
+        if policy == DROP_OLDEST:
+            self.push(message)
+            return
+        while len(self._responses) >= self.capacity:
+            if self.closed:
+                return
+            self._space.clear()
+            await self._space.wait()
+        self._responses.append((time.perf_counter(), message))
+        if len(self._responses) >= self.capacity:
+            self._space.clear()
+        self._ready.set()
+
+    def close(self):
+        #Wake producers blocked on a client that went away
+        self.closed = True
+        self._space.set()
+
+    def _append(self, message):
+        self._items.append((time.perf_counter(), message))
+        self._ready.set()
+
+    async def get(self):
+        while not self._responses and not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        if self._responses:
+            enqueued_at, message = self._responses.popleft()
+            self._space.set()
+        else:
+            enqueued_at, message = self._items.popleft()
+        lag = time.perf_counter() - enqueued_at
+        self.last_lag = lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+        self.sent += 1
+        return message
+
+    def stats(self):
+        return {
+            "queued": len(self._items) + len(self._responses),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_lag_ms": round(self.last_lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "topics": sorted(self.topics) if self.topics is not None else "all",
+            "encoding": self.encoding,
+            "binary_images": self.binary_images,
+        }
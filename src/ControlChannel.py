@@ -0,0 +1,62 @@
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+
+
+class ControlChannel:
+    """Delivers control characteristic replies to the transfer waiting for them.
+
+    Each transfer gets its own queue for its lifetime, so a reply can only satisfy the transfer
+    that was running when it arrived.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._queues = {}
+        self._active = None
+        self._lock = None
+
+    @asynccontextmanager
+    async def transfer(self):
+        #Transfers run one at a time, the next one starts with an empty queue
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            transfer_id = next(self._ids)
+            self._queues[transfer_id] = asyncio.Queue()
+            self._active = transfer_id
+            try:
+                yield transfer_id
+            finally:
+                self._active = None
+                del self._queues[transfer_id]
+
+    def dispatch(self, message):
+        #Called from the BLE notification callback, returns False if nobody was waiting for it
+        queue = self._queues.get(self._active)
+        if queue is None:
+            return False
+        queue.put_nowait(message)
+        return True
+
+    def discard_pending(self, transfer_id):
+        #Drop replies to earlier requests before sending a new one
+        queue = self._queues.get(transfer_id)
+        while queue is not None and not queue.empty():
+            queue.get_nowait()
+
+    async def wait(self, transfer_id, expected, timeout):
+        """Return the next reply starting with one of `expected`, raises TimeoutError after `timeout` seconds."""
+        queue = self._queues[transfer_id]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError("No ACK from Android device")
+            try:
+                message = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                raise TimeoutError("No ACK from Android device")
+            if message.startswith(expected):
+                return message
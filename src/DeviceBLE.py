@@ -1,14 +1,20 @@
 import asyncio
 import json
 import os
-from datetime import datetime
+import time
 
-import crcmod.predefined as crc
-import mss
-import mss.tools
 from bleak import BleakClient
 
+import AppSettings
 from ReadFile import read_file_b
+from src.ControlChannel import ControlChannel
+from src.FileTransfer import CRC32, FEATURE_HASH, FEATURE_SEQ, FEATURE_ZLIB, WINDOW_SIZE, XFER_HELLO, XFER_PREFIX, build_blocks, \
+    compress, content_hash, parse_features, parse_nack
+from src.InputFrame import InputFrame, toggle_keys
+from src.InputProtocol import PROTO_PREFIX, PROTO_REQUEST, is_binary_frame, parse_proto_reply
+from src.LatencyStats import LatencyHistogram
+from src.LatencyTrace import STAGE_DECODE, LatencyTracer
+from src.SessionLog import KIND_PAUSE, KIND_SCREENSHOT, KIND_STEP, SessionRecorder
 from src.config import emulation_state
 
 INPUT_SERVICE_UUID = "0000feed-0000-1000-8000-00805f9b34fb"
@@ -19,34 +25,86 @@ PAUSE_UUID= "446be5b0-93b7-4911-abbe-e4e18d545640"
 SCREENSHOT_UUID = "36d942a6-9e79-4812-8a8f-84a275f6b176"
 HEARTBEAT_UUID = "a5307aef-3109-42f7-b79e-a493856823ba"
 STEP_UUID = "c36f600d-a202-48cd-a839-7577abea4b1f"
+NOTIFY_UUIDS = (INPUT_CHAR_UUID, PAUSE_UUID, SCREENSHOT_UUID, HEARTBEAT_UUID, CONTROL_MESSAGE_CHAR_UUID, STEP_UUID)
+WRITE_UUIDS = (FILE_TRANSFER_CHAR_UUID, CONTROL_MESSAGE_CHAR_UUID, HEARTBEAT_UUID)
+#Heartbeat: "PING:<seq>" answered by "PONG:<seq>", the interval shrinks after a miss so a dead link is found quickly
+HEARTBEAT_INTERVAL = 3.0
+MIN_HEARTBEAT_INTERVAL = 0.5
+MIN_HEARTBEAT_TIMEOUT = 1.0
+MAX_HEARTBEAT_TIMEOUT = 5.0
+HEARTBEAT_MISSES = 3
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30.0
+ATT_OVERHEAD = 10
+MAX_RESEND_ROUNDS = 8
+# Whole-file restarts when every block passed but the file checksum did not
+MAX_FILE_ROUNDS = 3
 
 from src.XboxMapper.GamepadManager import GamepadManager
-from SocketHandler import SocketHandler
-from src.GPX.GetScreenshotsDir import get_screenshots_dir
-from src.GPX.ScreenshotHelper import save_screenshot_with_exif
+from SocketHandler import SocketHandler, TOPIC_STATS
+from src.GPX.ScreenshotWorker import ScreenshotWorker
 
 class DeviceBLE:
-    def __init__(self, ):
+    def __init__(self, ws_port = 9999, client_factory = BleakClient):
         self.client = None
+        #Anything that builds a BleakClient lookalike from (address, disconnected_callback), e.g. SimulatedPeripheral
+        self.client_factory = client_factory
         self.device = None
         self.uuid_input_service = INPUT_SERVICE_UUID
         self.uuid_input_characteristic = INPUT_CHAR_UUID
         self.uuid_pause_characteristic = PAUSE_UUID
         self.uuid_screenshot_characteristic = SCREENSHOT_UUID
-        self.socketHandler = SocketHandler(self)
-        self.gamepadManager = GamepadManager()
+        self.socketHandler = SocketHandler(self, ws_port)
+        self.gamepadManager = GamepadManager(output_rate_hz=AppSettings.get("output_rate_hz"),
+                                             stale_timeout=AppSettings.get("stale_input_timeout"))
+        #Input path latency per stage, off unless the "latency_trace" setting is on
+        self.tracer = LatencyTracer(enabled=bool(AppSettings.get("latency_trace", False)))
+        self.gamepadManager.tracer = self.tracer
+        self._trace_log_task = None
+        #Set while a session is being recorded for replay
+        self.recorder = None
         self.buffer = []
         self.expecting_chunks = 0
-        self.latest_control_message = None
+        self.control_channel = ControlChannel()
         self.address = None
         self.loop = None
         self.monitor_index = 1
+        self.screenshot_worker = ScreenshotWorker()
         self.on_disconnect = None
         self._disconnected = False
+        self._closing = False
+        #Opt in: reconnect straight to the cached address instead of reporting the disconnect
+        self.auto_reconnect = False
+        self.max_reconnect_attempts = None
+        self.on_reconnecting = None
+        self.on_reconnected = None
+        self.reconnect_count = 0
+        self.total_downtime = 0.0
+        self.last_downtime = None
+        self._down_since = None
+        self._reconnect_task = None
+        self._heartbeat_task = None
+        #GATT handles by UUID from the first service discovery, reused for every later subscribe and write
+        self._handles = {}
         self.latest_heartbeat = None
+        self.heartbeat_rtt = LatencyHistogram()
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.heartbeats_sent = 0
+        self.heartbeats_missed = 0
+        self.heartbeats_late = 0
+        self._missed_in_a_row = 0
+        self._ping_seq = 0
+        self._ping_sent_at = 0.0
+        self._pong = None
         self.gpx_manager = None
         self.gpx_external_control = False
         self.on_control_message = None
+        self.button_names = None
+        self._button_keys = None
+        self.transfer_features = frozenset()
+        #Content hash of the last layout sent, selects the profile bound to it
+        self.layout_hash = None
+        self.input_consumers = [self.socketHandler.on_input_frame, self._emulate_frame]
 
     async def connect(self):
         self.loop = asyncio.get_event_loop()
@@ -54,8 +112,10 @@ class DeviceBLE:
             try:
                 print(f"Found device at address:{self.address}")
                 print("Attempting to connect")
-                self.client = BleakClient(self.address, disconnected_callback=self._on_ble_disconnected)
+                self.client = self.client_factory(self.address, disconnected_callback=self._on_ble_disconnected)
                 await self.client.connect()
+                self._disconnected = False
+                self._closing = False
 
                 print("Connected")
             except Exception as e:
@@ -65,6 +125,20 @@ class DeviceBLE:
             raise Exception("Did not find available devices")
 
     async def disconnect(self):
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self._trace_log_task is not None:
+            self._trace_log_task.cancel()
+            self._trace_log_task = None
+        if self.gamepadManager is not None:
+            self.gamepadManager.close()
+        self.screenshot_worker.stop()
+        self.stop_recording()
         try:
             if self.client is not None:
                 await self.client.disconnect()
@@ -73,135 +147,351 @@ class DeviceBLE:
 
 
     async def start_heartbeat_loop(self):
-        asyncio.create_task(self._heartbeat_loop())
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
 
 
     async def _heartbeat_loop(self):
+        self._pong = asyncio.Event()
+        self._missed_in_a_row = 0
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
         while not self._disconnected:
-            await asyncio.sleep(3)
+            await asyncio.sleep(self.heartbeat_interval)
+            self._ping_seq = (self._ping_seq + 1) & 0xFFFF
+            self._pong.clear()
+            self.latest_heartbeat = None
             try:
-                self.latest_heartbeat = None
-                await self.client.write_gatt_char(HEARTBEAT_UUID, b"PING", response=False)
+                self._ping_sent_at = time.perf_counter()
+                await self.client.write_gatt_char(self._char(HEARTBEAT_UUID), f"PING:{self._ping_seq}".encode('utf-8'), response=False)
+                self.heartbeats_sent += 1
             except Exception as e:
                 print(f"Heartbeat Write Failed: {e}")
-                if not self._disconnected:
-                    self._disconnected = True
-                    if self.on_disconnect is not None:
-                        self.on_disconnect()
-                break
-            await asyncio.sleep(5)
-            if self.latest_heartbeat is None and not self._disconnected:
-                print("Heartbeat Time out")
-                self._disconnected = True
-                if self.on_disconnect is not None:
-                    self.on_disconnect()
+                self._link_lost()
                 break
 
+            try:
+                await asyncio.wait_for(self._pong.wait(), self._heartbeat_timeout())
+            except asyncio.TimeoutError:
+                if self._disconnected:
+                    break
+                self.heartbeats_missed += 1
+                self._missed_in_a_row += 1
+                print(f"Heartbeat {self._ping_seq} missed ({self._missed_in_a_row}/{HEARTBEAT_MISSES})")
+                if self._missed_in_a_row >= HEARTBEAT_MISSES:
+                    print("Heartbeat Time out")
+                    self._link_lost()
+                    break
+                self.heartbeat_interval = MIN_HEARTBEAT_INTERVAL
+                continue
+
+            self._missed_in_a_row = 0
+            #Back off towards the idle interval while the link stays healthy
+            self.heartbeat_interval = min(self.heartbeat_interval * 2, HEARTBEAT_INTERVAL)
+            self.socketHandler.addMessage(json.dumps(dict(self.heartbeat_stats(), type="link_stats")), topic=TOPIC_STATS)
+
+    def _heartbeat_timeout(self):
+        #A few times the slow end of the measured round trip, so a congested link is not mistaken for a dead one
+        p99, = self.heartbeat_rtt.percentiles(99)
+        if p99 is None:
+            return MAX_HEARTBEAT_TIMEOUT
+        return min(max(p99 * 4, MIN_HEARTBEAT_TIMEOUT), MAX_HEARTBEAT_TIMEOUT)
+
+    def heartbeat_stats(self):
+        return {
+            "rtt": self.heartbeat_rtt.summary(),
+            "sent": self.heartbeats_sent,
+            "missed": self.heartbeats_missed,
+            "late": self.heartbeats_late,
+            "missed_in_a_row": self._missed_in_a_row,
+            "interval_s": self.heartbeat_interval,
+        }
+
 
     def _on_ble_disconnected(self,client):
-        if not self._disconnected:
-            self._disconnected = True
-            if self.on_disconnect is not None:
-                self.on_disconnect()
+        if self._closing or client is not self.client:
+            return
+        self._link_lost()
+
+    def _link_lost(self):
+        #A deliberate disconnect is not a lost link, whatever fails while it tears things down
+        if self._disconnected or self._closing:
+            return
+        self._disconnected = True
+        if self.auto_reconnect and not self._closing:
+            self._down_since = time.monotonic()
+            if self._reconnect_task is None:
+                self._reconnect_task = self.loop.create_task(self._reconnect_loop())
+            if self.on_reconnecting is not None:
+                self.on_reconnecting()
+        elif self.on_disconnect is not None:
+            self.on_disconnect()
+
+    async def _reconnect_loop(self):
+        #GamepadManager, websocket clients and the GPX trail stay as they are, only the BLE link is rebuilt
+        delay = RECONNECT_DELAY
+        attempts = 0
+        try:
+            while not self._closing:
+                attempts += 1
+                try:
+                    await self.connect()
+                    await self.notify()
+                    await self.start_heartbeat_loop()
+                except Exception as e:
+                    print(f"Reconnect attempt {attempts} failed: {e}")
+                    self._disconnected = True
+                    #A link that connected but could not subscribe is closed, the next attempt builds a new one
+                    await self._drop_client()
+                    if self.max_reconnect_attempts is not None and attempts >= self.max_reconnect_attempts:
+                        break
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                    continue
+
+                self.last_downtime = time.monotonic() - self._down_since
+                self.total_downtime += self.last_downtime
+                self.reconnect_count += 1
+                print(f"Reconnected after {self.last_downtime:.1f}s ({attempts} attempts)")
+                self._reconnect_task = None
+                if self.on_reconnected is not None:
+                    self.on_reconnected()
+                return
+        except asyncio.CancelledError:
+            self._reconnect_task = None
+            raise
+
+        self._reconnect_task = None
+        if not self._closing and self.on_disconnect is not None:
+            self.on_disconnect()
+
+    async def _drop_client(self):
+        client = self.client
+        self.client = None      # its disconnected callback is ignored from here on
+        if client is not None and client.is_connected:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                print(f"Could not close the half open link: {e}")
+
+    def _char(self, uuid):
+        #A handle is an O(1) lookup in bleak, a UUID string is a scan over every characteristic
+        return self._handles.get(uuid, uuid)
+
+    def _discover_handles(self):
+        services = self.client.services
+        handles = {}
+        for uuid in NOTIFY_UUIDS + WRITE_UUIDS:
+            characteristic = services.get_characteristic(uuid)
+            if characteristic is not None:
+                handles[uuid] = characteristic.handle
+        return handles
 
     async def notify(self):
         if self.client and self.client.is_connected:
-            characteristic = self.client.services.get_characteristic(self.uuid_input_characteristic)
-            if characteristic:
+            if not self._handles:
+                characteristic = self.client.services.get_characteristic(self.uuid_input_characteristic)
+                if not characteristic:
+                    print(f"Error, characteristic {self.uuid_input_characteristic} not found in discovered services.")
+                    return
                 print(f"Characteristic found: {characteristic.uuid}")
-                await self.client.start_notify(self.uuid_input_characteristic, self.input_handler)
-                await self.client.start_notify(self.uuid_pause_characteristic, self.pause_handler)
-                await self.client.start_notify(self.uuid_screenshot_characteristic, self.screenshot_handler)
-                await self.client.start_notify(HEARTBEAT_UUID, self.heartbeat_handler)
-                await self.client.start_notify(CONTROL_MESSAGE_CHAR_UUID, self.control_handler)
-                await self.client.start_notify(STEP_UUID, self.step_handler)
-                print(f"Subscribed to notifications")
-            else:
-                print(f"Error, characteristic {self.uuid_input_characteristic} not found in discovered services.")
+                self._handles = self._discover_handles()
+
+            self.buffer = []
+            handlers = {
+                INPUT_CHAR_UUID: self.input_handler,
+                PAUSE_UUID: self.pause_handler,
+                SCREENSHOT_UUID: self.screenshot_handler,
+                HEARTBEAT_UUID: self.heartbeat_handler,
+                CONTROL_MESSAGE_CHAR_UUID: self.control_handler,
+                STEP_UUID: self.step_handler,
+            }
+            try:
+                for uuid in NOTIFY_UUIDS:
+                    await self.client.start_notify(self._char(uuid), handlers[uuid])
+            except Exception as e:
+                if not self._handles:
+                    raise
+                #Only a changed GATT table (app reinstalled) replaces the cache, a transient error keeps it
+                handles = self._discover_handles()
+                if handles == self._handles:
+                    raise
+                print(f"Cached handles rejected, rediscovering: {e}")
+                self._handles = handles
+                for uuid in NOTIFY_UUIDS:
+                    await self.client.start_notify(self._char(uuid), handlers[uuid])
+            print(f"Subscribed to notifications")
+            if self._trace_log_task is None:
+                self._trace_log_task = asyncio.create_task(self.tracer.log_periodically(AppSettings.get("latency_log_interval", 30)))
+            #Started once there is a connection, a device that never connects leaves no watcher thread behind
+            gamepad = self.gamepadManager
+            if gamepad is not None and gamepad.config_watcher is None and AppSettings.get("watch_config", True):
+                gamepad.start_config_watcher()
+            await self.negotiate_input_protocol()
+            await self.negotiate_transfer()
 
     def screenshot_handler(self, sender, data):
+        if self.recorder is not None:
+            self.recorder.event(KIND_SCREENSHOT, time.perf_counter())
         self.socketHandler.addMessage(json.dumps({"type": "screenshot"}))
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        screenshots_dir = get_screenshots_dir()
-
-        if self.gpx_manager is not None:
-            lat, lon = self.gpx_manager.current_position()
-            png_path = os.path.join(screenshots_dir, f"screenshot_{timestamp}_tmp.png")
-            with mss.MSS() as sct:
-                sct.shot(mon = self.monitor_index, output = png_path)
-            jpg_path = os.path.join(screenshots_dir, f"screenshot_{timestamp}.jpg")
-            save_screenshot_with_exif(png_path,jpg_path,lat,lon)
-        else:
-            path = os.path.join(get_screenshots_dir(), f"screenshot_{timestamp}.png")
-            with mss.mss() as sct:
-                sct.shot(mon = self.monitor_index, output = path)
+        #Capture and encoding happen on the worker thread, this callback returns straight away
+        position = self.gpx_manager.current_position() if self.gpx_manager is not None else None
+        self.screenshot_worker.request(self.monitor_index, position)
 
 
     def heartbeat_handler(self, sender, data):
-        self.latest_heartbeat = data.decode('utf-8')
+        now = time.perf_counter()
+        reply = data.decode('utf-8')
+        self.latest_heartbeat = reply
+        if reply.startswith("PONG:"):
+            try:
+                seq = int(reply[5:])
+            except ValueError:
+                return
+            if seq != self._ping_seq:
+                #Answer to a beat we already gave up on
+                self.heartbeats_late += 1
+                return
+        #Older apps answer with a bare reply, credit it to the beat in flight
+        if self._pong is not None and not self._pong.is_set():
+            self.heartbeat_rtt.record(now - self._ping_sent_at)
+            self._pong.set()
 
     def pause_handler(self, sender, data):
+        if self.recorder is not None:
+            self.recorder.event(KIND_PAUSE, time.perf_counter())
         self.socketHandler.addMessage(json.dumps({"type": "pause"}))
         print("Pause triggered")
         if emulation_state.enabled and self.gamepadManager is not None:
-            asyncio.create_task(self._pulse_event("toggle:pause"))
-
-    async def _pulse_event(self, input_key, hold=0.1):
-        self.gamepadManager.set_event(input_key, True)
-        await asyncio.sleep(hold)
-        self.gamepadManager.set_event(input_key, False)
+            self.gamepadManager.pulse_event("toggle:pause", 0.1)
 
     def step_handler(self, sender, data):
+        if self.recorder is not None:
+            self.recorder.event(KIND_STEP, time.perf_counter())
         if self.gpx_manager is not None and not self.gpx_external_control:
             self.gpx_manager.on_step()
         elif self.gpx_external_control:
             self.socketHandler.addMessage(json.dumps({"type": "step"}))
 
 
-    def input_handler(self, sender, data):
-        value = data.decode('utf-8')
+    async def negotiate_input_protocol(self):
+        #Ask for binary input frames, older Android builds ignore this and keep sending JSON
+        self.button_names = None
+        self._button_keys = None
+        try:
+            await self.write_control(PROTO_REQUEST)
+        except Exception as e:
+            print(f"Binary input negotiation failed, using JSON: {e}")
 
-        if value.startswith("START:"):
-            parts = value.split(":",2)
-            self.expecting_chunks = int(parts[1])
-            self.buffer = [parts[2]]
-            return
-        elif value.startswith("CHUNK:"):
-            parts = value.split(":",2)
-            self.buffer.append(parts[2])
-            return
-        elif value.startswith("END:"):
-            self.buffer.append(value[4:])
-            value = "".join(self.buffer)
-            self.buffer = []
-            self.expecting_chunks = 0
+    async def negotiate_transfer(self):
+        #Ask which file transfer features the phone supports, no reply means legacy whole-file transfers
+        self.transfer_features = frozenset()
+        try:
+            await self.write_control(XFER_HELLO)
+        except Exception as e:
+            print(f"Transfer negotiation failed, using legacy transfers: {e}")
 
-        self.socketHandler.addMessage(value)
+    def input_handler(self, sender, data):
+        received_at = time.perf_counter()
+        if is_binary_frame(data):
+            if self._button_keys is None:
+                return
+            if self.recorder is not None:
+                self.recorder.input_binary(data, received_at)
+            frame = InputFrame.from_binary(data, self._button_keys, received_at)
+        else:
+            value = data.decode('utf-8')
 
+            if value.startswith("START:"):
+                parts = value.split(":",2)
+                self.expecting_chunks = int(parts[1])
+                self.buffer = [parts[2]]
+                return
+            elif value.startswith("CHUNK:"):
+                parts = value.split(":",2)
+                self.buffer.append(parts[2])
+                return
+            elif value.startswith("END:"):
+                self.buffer.append(value[4:])
+                value = "".join(self.buffer)
+                self.buffer = []
+                self.expecting_chunks = 0
+
+            if self.recorder is not None:
+                self.recorder.input_json(value, received_at)
+            frame = InputFrame.from_json(value, received_at)
+
+        if frame is not None:
+            if self.tracer.enabled:
+                self.tracer.record(STAGE_DECODE, received_at)
+                if frame.sent_at is not None:
+                    self.tracer.record_sender(frame.sent_at, received_at)
+            self.dispatch_frame(frame)
+
+    def start_recording(self, path=None):
+        self.stop_recording()
+        self.recorder = SessionRecorder(path, self.button_names)
+        print(f"Recording session to {self.recorder.path}")
+        return self.recorder.path
+
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+            print(f"Recorded {recorder.records} records to {recorder.path}")
+
+    def dispatch_frame(self, frame):
+        #Every notification is decoded once and handed to each consumer
+        for consumer in self.input_consumers:
+            consumer(frame)
+
+    def add_input_consumer(self, consumer):
+        self.input_consumers.append(consumer)
+
+    def remove_input_consumer(self, consumer):
+        if consumer in self.input_consumers:
+            self.input_consumers.remove(consumer)
+
+    def _emulate_frame(self, frame):
         if emulation_state.enabled and self.gamepadManager is not None:
-            self.gamepadManager.update_state(value)
+            self.gamepadManager.update_state(frame)
 
     def control_handler(self,sender,data):
         message = data.decode('utf-8')
-        self.latest_control_message = message
+        if message.startswith(PROTO_PREFIX):
+            self.button_names = parse_proto_reply(message)
+            self._button_keys = toggle_keys(self.button_names) if self.button_names is not None else None
+            if self.recorder is not None and self.button_names is not None:
+                self.recorder.buttons(self.button_names, time.perf_counter())
+            print(f"Binary input frames {'enabled' if self.button_names is not None else 'unsupported'}")
+            return
+        if message.startswith(XFER_PREFIX):
+            self.transfer_features = parse_features(message)
+            print(f"File transfer features: {', '.join(sorted(self.transfer_features)) or 'none'}")
+            return
+        self.control_channel.dispatch(message)
 
-    async def wait_for_response(self, timeout=5):
-        attempts = 0
-        while attempts < 3:
-            start = asyncio.get_event_loop().time()
-            while asyncio.get_event_loop().time() - start < timeout:
-                if self.latest_control_message in ("OK","RESEND"):
-                    return self.latest_control_message
-                await asyncio.sleep(0.05)
-            attempts += 1
-        raise TimeoutError("No ACK from Android device")
+    async def wait_for_response(self, transfer_id, timeout=5, attempts=3, expected=("OK","RESEND")):
+        #Resolved by control_handler as soon as the reply notification arrives
+        return await self.control_channel.wait(transfer_id, expected, timeout * attempts)
+
+    async def request(self, transfer_id, message, expected=("OK","RESEND")):
+        self.control_channel.discard_pending(transfer_id)
+        await self.write_control(message)
+        return await self.wait_for_response(transfer_id, expected=expected)
 
+    async def write_control(self, message):
+        await self.client.write_gatt_char(
+            self._char(CONTROL_MESSAGE_CHAR_UUID),
+            message.encode('utf-8'),
+            response=True
+        )
 
     async def send_chunks(self,data, CHUNK_SIZE):
         for i in range(0, len(data), CHUNK_SIZE):
             chunk = data[i:i + CHUNK_SIZE]
             await self.client.write_gatt_char(
-                FILE_TRANSFER_CHAR_UUID,
+                self._char(FILE_TRANSFER_CHAR_UUID),
                 chunk,
                 response=False
             )
@@ -210,53 +500,110 @@ class DeviceBLE:
     async def send_file(self, filename):
 
         if self.client and self.client.is_connected:
-            import os
             basename = os.path.basename(filename)
             print("File transfer started")
             mtu_size = self.client.mtu_size
-            ATT_OVERHEAD = 10
             CHUNK_SIZE = mtu_size - ATT_OVERHEAD
             data = read_file_b(filename)
-            await self.client.write_gatt_char(
-                CONTROL_MESSAGE_CHAR_UUID,
-                f"START:{basename}".encode('utf-8'),
-                response=True
-            )
-            await self.send_chunks(data, CHUNK_SIZE)
+            self.layout_hash = content_hash(data)
+            await self._activate_layout_profile()
 
-            crc32 = crc.mkPredefinedCrcFun("crc-32")
-            checksum = crc32(data)
-            await self.client.write_gatt_char(
-                CONTROL_MESSAGE_CHAR_UUID,
-                f"CHECKSUM:{checksum}".encode('utf-8'),
-                response = True
-            )
-            try:
-                result = await self.wait_for_response()
-            except TimeoutError:
-                print("No ACK from Android device after 3 tries, aborting.")
-                return
+            async with self.control_channel.transfer() as transfer_id:
+                if FEATURE_HASH in self.transfer_features and await self._phone_has(transfer_id, data):
+                    print(f"File {filename} already on device, skipped")
+                    return
 
-            while result != "OK":
-                print(result)
-                await self.send_chunks(data, CHUNK_SIZE)
-                await self.client.write_gatt_char(
-                    CONTROL_MESSAGE_CHAR_UUID,
-                    f"CHECKSUM:{checksum}".encode('utf-8'),
-                    response=True
-                )
-                try:
-                    result = await self.wait_for_response()
-                except TimeoutError:
-                    print("No ACK from Android device after 3 tries, aborting.")
+                #The phone inflates the payload before saving it, the CRC covers the bytes actually sent
+                payload = compress(data) if FEATURE_ZLIB in self.transfer_features else None
+                encoding = f":ZLIB:{len(data)}" if payload is not None else ""
+                if payload is None:
+                    payload = data
+                checksum = CRC32(payload)
+
+                blocks = build_blocks(payload, CHUNK_SIZE) if FEATURE_SEQ in self.transfer_features else None
+                if blocks is not None:
+                    start = f"START:{basename}:SEQ:{len(payload)}:{len(blocks)}{encoding}"
+                    sent = await self._send_sequenced(transfer_id, start, blocks, checksum)
+                else:
+                    sent = await self._send_whole(transfer_id, f"START:{basename}{encoding}", payload, CHUNK_SIZE, checksum)
+                if not sent:
+                    print("File transfer to Android device failed, aborting.")
                     return
 
-            await self.client.write_gatt_char(
-                CONTROL_MESSAGE_CHAR_UUID,
-                f"END".encode('utf-8'),
-                response=True
-            )
-            print(f"File {filename} sent")
+                await self.write_control("END")
+            print(f"File {filename} sent ({len(payload)} of {len(data)} bytes on the wire)")
+
+    async def _activate_layout_profile(self):
+        gamepad = self.gamepadManager
+        if gamepad is None:
+            return
+        name = gamepad.profiles.profile_for_layout(self.layout_hash)
+        if name is None or name == gamepad.active_profile:
+            return
+        try:
+            #Parsing happens on a worker thread, the swap itself is O(1)
+            await asyncio.to_thread(gamepad.load_profile, name)
+        except (OSError, KeyError, ValueError, TypeError, AttributeError) as e:
+            print(f"Could not switch to profile {name} for this layout: {e}")
+
+    async def _phone_has(self, transfer_id, data):
+        #One round trip, a phone already holding this exact content loads it from its own store
+        try:
+            reply = await self.request(transfer_id, f"HAVE:{content_hash(data)}", expected=("HAVE", "MISS"))
+        except TimeoutError:
+            return False
+        return reply == "HAVE"
+
+    async def _send_whole(self, transfer_id, start, data, CHUNK_SIZE, checksum):
+        #Legacy transfer, the whole file is resent until the phone's CRC matches or MAX_FILE_ROUNDS is reached
+        await self.write_control(start)
+        for _ in range(MAX_FILE_ROUNDS):
+            await self.send_chunks(data, CHUNK_SIZE)
+            try:
+                result = await self.request(transfer_id, f"CHECKSUM:{checksum}")
+            except TimeoutError:
+                return False
+            if result == "OK":
+                return True
+            print(result)
+        print(f"File checksum still failing after {MAX_FILE_ROUNDS} full sends, aborting.")
+        return False
+
+    async def _send_sequenced(self, transfer_id, start, blocks, checksum):
+        #Blocks go out a window at a time, the phone NACKs a bitmap of bad blocks and only those are resent.
+        #Each window waits for its ACK before the next is written, ACK carries no window number to pipeline on
+        await self.write_control(start)
+        for _ in range(MAX_FILE_ROUNDS):
+            for base in range(0, len(blocks), WINDOW_SIZE):
+                count = min(WINDOW_SIZE, len(blocks) - base)
+                pending = range(base, base + count)
+                rounds = 0
+                while pending:
+                    if rounds == MAX_RESEND_ROUNDS:
+                        print(f"Blocks {list(pending)} still failing after {rounds} resends, aborting.")
+                        return False
+                    for seq in pending:
+                        await self.client.write_gatt_char(self._char(FILE_TRANSFER_CHAR_UUID), blocks[seq], response=False)
+                    try:
+                        result = await self.request(transfer_id, f"WINDOW:{base}:{count}", expected=("ACK", "NACK"))
+                    except TimeoutError:
+                        return False
+                    try:
+                        pending = parse_nack(result, base, count) if result.startswith("NACK") else ()
+                    except ValueError:
+                        pending = range(base, base + count)
+                    rounds += 1
+
+            try:
+                result = await self.request(transfer_id, f"CHECKSUM:{checksum}")
+            except TimeoutError:
+                return False
+            if result == "OK":
+                return True
+            #Every block passed its own CRC but the file did not, start the whole sequence again
+            print(result)
+        print(f"File checksum still failing after {MAX_FILE_ROUNDS} full sends, aborting.")
+        return False
 
     async def layout_received(self,filename):
         await self.send_file(filename)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import hashlib
+import struct
+import zlib
+
+import crcmod.predefined as crc
+
+# Built once, mkPredefinedCrcFun generates the lookup table every time it is called
+CRC32 = crc.mkPredefinedCrcFun("crc-32")
+
+# Capability handshake on the control characteristic. Newer Android builds answer XFER_HELLO
+# with "XFER:<feature>,<feature>"; older builds never answer and only get the legacy transfer.
+XFER_PREFIX = "XFER:"
+XFER_HELLO = "XFER:HELLO"
+FEATURE_SEQ = "SEQ"
+FEATURE_ZLIB = "ZLIB"
+FEATURE_HASH = "HASH"
+
+# Sequenced transfer: every write is one block, prefixed with its number and its own CRC so the
+# phone can report exactly which blocks are missing or corrupt.
+BLOCK_HEADER = struct.Struct("<HI")
+MAX_BLOCKS = 0xFFFF
+WINDOW_SIZE = 32
+
+
+def parse_features(message):
+    features = message[len(XFER_PREFIX):]
+    return frozenset(f for f in features.split(",") if f)
+
+
+def build_blocks(data, chunk_size):
+    payload_size = chunk_size - BLOCK_HEADER.size
+    if payload_size <= 0:
+        return None
+    view = memoryview(data)
+    blocks = []
+    for seq, offset in enumerate(range(0, len(data), payload_size)):
+        payload = view[offset:offset + payload_size]
+        blocks.append(BLOCK_HEADER.pack(seq, CRC32(payload)) + payload)
+    if len(blocks) > MAX_BLOCKS:
+        return None
+    return blocks
+
+
+def parse_nack(message, base, count):
+    # "NACK:<base>:<hex bitmap>", bit i set means block base + i has to be sent again.
+    # Raises ValueError for a malformed NACK or one about another window, bits past the window are ignored
+    _, nack_base, bitmap = message.split(":", 2)
+    if int(nack_base) != base:
+        raise ValueError(f"NACK for window {nack_base} while waiting for window {base}")
+    mask = int(bitmap, 16) & ((1 << count) - 1)
+    missing = []
+    i = 0
+    while mask:
+        if mask & 1:
+            missing.append(base + i)
+        mask >>= 1
+        i += 1
+    return missing
+
+
+def content_hash(data):
+    # Layouts are addressed by content, the phone keeps the ones it has received under this key
+    return hashlib.sha256(data).hexdigest()
+
+
+def compress(data):
+    # Layout JSON deflates 5-10x, returns None when compression would not make the transfer smaller
+    compressed = zlib.compress(data, 9)
+    if len(compressed) >= len(data):
+        return None
+    return compressed
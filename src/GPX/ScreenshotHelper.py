@@ -1,4 +1,4 @@
-import os
+import io
 
 import piexif
 from PIL import Image
@@ -10,13 +10,35 @@ def _to_dms(value):
     s = round(((abs(value) - d ) * 60 - m) *60 * 1000)
     return ((d,1),(m,1),(s,1000))
 
-def save_screenshot_with_exif(png_path, output_path, lat, lon):
+def _gps_exif(lat, lon):
     gps_ifd = {
         piexif.GPSIFD.GPSLatitudeRef: b"N" if lat >= 0 else b"S",
         piexif.GPSIFD.GPSLatitude: _to_dms(lat),
         piexif.GPSIFD.GPSLongitudeRef: b"E" if lon >= 0 else b"W",
         piexif.GPSIFD.GPSLongitude: _to_dms(lon)
     }
-    exif_bytes = piexif.dump({"GPS": gps_ifd})
-    Image.open(png_path).save(output_path, "jpeg", exif=exif_bytes)
-    os.remove(png_path)
+    return piexif.dump({"GPS": gps_ifd})
+
+def _to_image(source, size, raw_mode):
+    if isinstance(source, Image.Image):
+        return source
+    if size is not None:
+        # Raw pixels, e.g. an mss grab: decode straight from the buffer
+        return Image.frombuffer("RGB", size, source, "raw", raw_mode, 0, 1)
+    return Image.open(io.BytesIO(source))
+
+def jpeg_with_exif(source, lat, lon, size=None, raw_mode="RGB"):
+    """Encode `source` as a GPS tagged JPEG and return the bytes, nothing touches the disk.
+
+    `source` is a PIL image, encoded image bytes (PNG, JPEG...) or raw pixels when `size` is given.
+    """
+    image = _to_image(source, size, raw_mode)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "jpeg", exif=_gps_exif(lat, lon))
+    return buffer.getvalue()
+
+def save_jpeg_with_exif(source, output_path, lat, lon, size=None, raw_mode="RGB"):
+    with open(output_path, "wb") as f:
+        f.write(jpeg_with_exif(source, lat, lon, size, raw_mode))
@@ -0,0 +1,89 @@
+import os
+import queue
+import threading
+from datetime import datetime
+
+import mss
+from PIL import Image
+
+from src.GPX.GetScreenshotsDir import get_screenshots_dir
+from src.GPX.ScreenshotHelper import save_jpeg_with_exif
+
+
+class ScreenshotWorker:
+    """Grabs and encodes screenshots on its own thread so BLE callbacks return immediately.
+
+    At most `max_pending` captures wait in the queue. A request that arrives while the queue is
+    full is merged into the capture already waiting, which will grab the screen as it is then.
+    """
+
+    def __init__(self, max_pending=1):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._stop = threading.Event()
+        self.captured = 0
+        self.merged = 0
+        self.failed = 0
+
+    def request(self, monitor_index, position=None):
+        #position is (lat, lon) to tag the screenshot with, or None for a plain PNG
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ScreenshotWorker", daemon=True)
+            self._thread.start()
+        elif not self._thread.is_alive():
+            #The worker could not open the screen, nothing would ever take this request off the queue
+            self.failed += 1
+            return
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        try:
+            self._queue.put_nowait((monitor_index, position, timestamp))
+        except queue.Full:
+            self.merged += 1
+
+    def stop(self):
+        if self._thread is None:
+            return
+        #Never blocks: pending captures are dropped and the wake-up only goes in if there is room
+        self._stop.set()
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def _run(self):
+        #mss handles are not shareable across threads, this one lives as long as the worker
+        try:
+            sct = mss.MSS()
+        except Exception as e:
+            print(f"Screenshots unavailable, could not open the screen: {e}")
+            return
+        with sct:
+            while not self._stop.is_set():
+                job = self._queue.get()
+                if job is None or self._stop.is_set():
+                    return
+                try:
+                    self._capture(sct, *job)
+                    self.captured += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Screenshot failed: {e}")
+
+    def _capture(self, sct, monitor_index, position, timestamp):
+        shot = sct.grab(sct.monitors[monitor_index])
+        screenshots_dir = get_screenshots_dir()
+        if position is not None:
+            lat, lon = position
+            path = os.path.join(screenshots_dir, f"screenshot_{timestamp}.jpg")
+            save_jpeg_with_exif(shot.bgra, path, lat, lon, size=shot.size, raw_mode="BGRX")
+        else:
+            Image.frombuffer("RGB", shot.size, shot.bgra, "raw", "BGRX", 0, 1).save(
+                os.path.join(screenshots_dir, f"screenshot_{timestamp}.png"))
@@ -0,0 +1,90 @@
+import json
+import math
+import time
+
+from src.InputProtocol import decode_frame
+from src.WireFormat import pack
+
+
+def toggle_keys(button_names):
+    #Build the "toggle:<name>" lookup keys once per negotiation instead of once per frame
+    return tuple(f"toggle:{name}" for name in button_names)
+
+
+class InputFrame:
+    """One decoded controller notification, shared by every input consumer.
+
+    `inputs` is the flat lookup used by the gamepad mapping, `to_json()` and `to_msgpack()` are the
+    websocket payloads; each is built at most once per frame.
+    """
+    __slots__ = ("inputs", "received_at", "sent_at", "_state", "_json", "_msgpack")
+
+    def __init__(self, inputs, received_at=None, state=None, raw_json=None):
+        self.inputs = inputs
+        self.received_at = time.perf_counter() if received_at is None else received_at
+        #Sender clock in milliseconds, only when the app includes "ts"
+        self.sent_at = None
+        self._state = state
+        self._json = raw_json
+        self._msgpack = None
+
+    @classmethod
+    def from_json(cls, text, received_at=None):
+        try:
+            state = json.loads(text)
+        except json.decoder.JSONDecodeError:
+            return None
+        if not isinstance(state, dict):
+            return None
+
+        #Make a flat dictionary for easy lookup, State dictionary has buttons in an array, looping through an array every time is inefficient
+        inputs = {}
+        for button in state.get("buttons", []):
+            inputs[f"toggle:{button['name']}"] = button["pressed"]
+        inputs["toggle:stepping"] = True if state.get("stepping") else False
+        inputs["float:pitch"] = state.get("pitch", 0.0)
+        inputs["float:roll"] = state.get("roll", 0.0)
+        #The sender already serialized this frame, relay it verbatim
+        frame = cls(inputs, received_at, state=state, raw_json=text)
+        #Sender clock in ms, only trusted when it is a finite number
+        sent_at = state.get("ts")
+        if isinstance(sent_at, (int, float)) and not isinstance(sent_at, bool) and math.isfinite(sent_at):
+            frame.sent_at = sent_at
+        return frame
+
+    @classmethod
+    def from_binary(cls, data, button_keys, received_at=None):
+        decoded = decode_frame(data)
+        if decoded is None:
+            return None
+        mask, pitch, roll, stepping, sent_ms = decoded
+        inputs = {key: bool(mask >> i & 1) for i, key in enumerate(button_keys)}
+        inputs["toggle:stepping"] = stepping
+        inputs["float:pitch"] = pitch
+        inputs["float:roll"] = roll
+        frame = cls(inputs, received_at)
+        frame.sent_at = sent_ms
+        return frame
+
+    def to_state(self):
+        #Same shape as the JSON the Android app sends
+        if self._state is None:
+            inputs = self.inputs
+            self._state = {
+                "buttons": [{"name": key[7:], "pressed": pressed} for key, pressed in inputs.items()
+                            if key.startswith("toggle:") and key != "toggle:stepping"],
+                "stepping": inputs["toggle:stepping"],
+                "pitch": inputs["float:pitch"],
+                "roll": inputs["float:roll"],
+            }
+        return self._state
+
+    def to_json(self):
+        if self._json is None:
+            self._json = json.dumps(self.to_state())
+        return self._json
+
+    def to_msgpack(self):
+        if self._msgpack is None:
+            self._msgpack = pack(self.to_state())
+        return self._msgpack
@@ -0,0 +1,77 @@
+import struct
+
+# Compact binary input frame, negotiated over the control characteristic.
+# The first byte can never start a UTF-8 string, so binary and text (JSON / START: / CHUNK: / END:)
+# notifications can share INPUT_CHAR_UUID and be told apart by looking at a single byte.
+BINARY_FRAME_MAGIC = 0xFB
+BINARY_FRAME_VERSION = 1
+# Version 2 is version 1 followed by the sender's clock, so latency tracing also covers the binary path
+BINARY_FRAME_VERSION_TS = 2
+FRAME_VERSIONS = (BINARY_FRAME_VERSION, BINARY_FRAME_VERSION_TS)
+
+# magic, version, button bitmask, pitch, roll, stepping
+# pitch and roll are fixed point radians (value * FIXED_POINT_SCALE) so +-pi fits in an int16
+FRAME_V1 = struct.Struct("<BBIhhB")
+# FRAME_V1 plus uint32 milliseconds on a monotonic sender clock, wrapping every ~49 days
+FRAME_V2 = struct.Struct("<BBIhhBI")
+FIXED_POINT_SCALE = 10000.0
+MAX_BUTTONS = 32
+
+# Host asks with PROTO_REQUEST, newer Android builds answer "PROTO:BIN:<version>:<name0>,<name1>,..."
+# where name N is bit N of the button bitmask and version is the frame version they will send (1 or 2).
+# Older builds never answer and stay on JSON.
+PROTO_PREFIX = "PROTO:BIN:"
+PROTO_REQUEST = f"{PROTO_PREFIX}{BINARY_FRAME_VERSION}"
+
+
+def is_binary_frame(data):
+    return len(data) > 0 and data[0] == BINARY_FRAME_MAGIC
+
+
+def parse_proto_reply(message):
+    # Returns the negotiated button names, or None if the reply is not a version we can decode
+    parts = message[len(PROTO_PREFIX):].split(":", 1)
+    try:
+        version = int(parts[0])
+    except ValueError:
+        return None
+    if version not in FRAME_VERSIONS:
+        return None
+    names = parts[1].split(",") if len(parts) > 1 and parts[1] else []
+    return tuple(names[:MAX_BUTTONS])
+
+
+def decode_frame(data):
+    # Unpacks straight from the notification buffer, no utf-8 decode or string splitting
+    # Returns (button bitmask, pitch, roll, stepping, sent ms or None) or None if this is not a frame we understand
+    if len(data) < FRAME_V1.size:
+        return None
+    version = data[1]
+    if version == BINARY_FRAME_VERSION:
+        _magic, _version, mask, pitch, roll, stepping = FRAME_V1.unpack_from(data)
+        sent_ms = None
+    elif version == BINARY_FRAME_VERSION_TS and len(data) >= FRAME_V2.size:
+        _magic, _version, mask, pitch, roll, stepping, sent_ms = FRAME_V2.unpack_from(data)
+    else:
+        return None
+    return mask, pitch / FIXED_POINT_SCALE, roll / FIXED_POINT_SCALE, bool(stepping), sent_ms
+
+
+def encode_frame(pressed, pitch, roll, stepping, sent_ms=None):
+    # Mirror of decode_frame, used by the Android side's reference implementation and tooling
+    # A sent_ms makes it a version 2 frame
+    mask = 0
+    for i, is_pressed in enumerate(pressed[:MAX_BUTTONS]):
+        if is_pressed:
+            mask |= 1 << i
+    fields = (
+        BINARY_FRAME_MAGIC,
+        BINARY_FRAME_VERSION if sent_ms is None else BINARY_FRAME_VERSION_TS,
+        mask,
+        int(round(pitch * FIXED_POINT_SCALE)),
+        int(round(roll * FIXED_POINT_SCALE)),
+        1 if stepping else 0,
+    )
+    if sent_ms is None:
+        return FRAME_V1.pack(*fields)
+    return FRAME_V2.pack(*fields, int(sent_ms) & 0xFFFFFFFF)
@@ -0,0 +1,47 @@
+from collections import deque
+
+
+class LatencyHistogram:
+    """Rolling window of the most recent latency samples, in seconds, with percentile summaries.
+
+    Recording is a single deque append so it is safe on the BLE callback path; sorting only
+    happens when someone asks for a summary.
+    """
+    __slots__ = ("_samples", "count", "max")
+
+    def __init__(self, window=512):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentiles(self, *points):
+        ordered = sorted(self._samples)
+        if not ordered:
+            return [None for _ in points]
+        last = len(ordered) - 1
+        return [ordered[min(last, int(round(p / 100 * last)))] for p in points]
+
+    def summary(self):
+        p50, p95, p99 = self.percentiles(50, 95, 99)
+        return {
+            "count": self.count,
+            "p50_ms": _ms(p50),
+            "p95_ms": _ms(p95),
+            "p99_ms": _ms(p99),
+            "max_ms": _ms(self.max) if self.count else None,
+        }
+
+    def reset(self):
+        self._samples.clear()
+        self.count = 0
+        self.max = 0.0
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
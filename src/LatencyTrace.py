@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from src.LatencyStats import LatencyHistogram
+
+# Every stage is measured from the moment the notification reached input_handler (InputFrame.received_at)
+STAGE_LINK = "link"             # sender timestamp -> notification, relative to the fastest frame seen
+STAGE_DECODE = "decode"         # notification -> InputFrame built
+STAGE_GAMEPAD = "gamepad"       # notification -> report flushed to the driver
+STAGE_WEBSOCKET = "websocket"   # notification -> websocket.send returned
+STAGES = (STAGE_LINK, STAGE_DECODE, STAGE_GAMEPAD, STAGE_WEBSOCKET)
+
+
+class LatencyTracer:
+    """Per-stage latency histograms for the input path.
+
+    Call sites check `enabled` before reading the clock, so a disabled tracer costs one attribute lookup.
+    """
+
+    def __init__(self, enabled=False, window=1024):
+        self.enabled = enabled
+        self.stages = {stage: LatencyHistogram(window) for stage in STAGES}
+        #Phone and PC clocks are not synced, link latency is reported above the best one way delay seen
+        self._min_offset = None
+
+    def record(self, stage, since):
+        self.stages[stage].record(time.perf_counter() - since)
+
+    def record_sender(self, sent_ms, received_at):
+        offset = received_at * 1000 - sent_ms
+        if self._min_offset is None or offset < self._min_offset:
+            self._min_offset = offset
+        self.stages[STAGE_LINK].record((offset - self._min_offset) / 1000)
+
+    def summary(self):
+        return {stage: histogram.summary() for stage, histogram in self.stages.items()}
+
+    def reset(self):
+        for histogram in self.stages.values():
+            histogram.reset()
+        self._min_offset = None
+
+    async def log_periodically(self, interval=30):
+        last_counts = None
+        while True:
+            await asyncio.sleep(interval)
+            if not self.enabled:
+                continue
+            counts = tuple(histogram.count for histogram in self.stages.values())
+            if counts == last_counts:
+                continue
+            last_counts = counts
+            parts = []
+            for stage, stats in self.summary().items():
+                if stats["count"]:
+                    parts.append(f"{stage} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+            print("Latency: " + ", ".join(parts))
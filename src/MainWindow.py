@@ -143,6 +143,10 @@ class ServerGUI(QMainWindow):
         self.emulation_toggle.stateChanged.connect(self.on_emulation_toggled)
         config.emulation_state.changed.connect(self._on_emulation_state_changed)
 
+        self.reconnect_toggle = QCheckBox("Reconnect Automatically")
+        self.reconnect_toggle.setChecked(bool(AppSettings.get("auto_reconnect", False)))
+        self.reconnect_toggle.stateChanged.connect(self.on_reconnect_toggled)
+
         self.monitor_dropdown = QComboBox()
         self.populate_monitors()
         self.monitor_dropdown.currentIndexChanged.connect(self.on_monitor_changed)
@@ -151,6 +155,7 @@ class ServerGUI(QMainWindow):
         self.replay_tutorial_button.clicked.connect(self._run_tutorial)
 
         settings_layout.addWidget(self.emulation_toggle)
+        settings_layout.addWidget(self.reconnect_toggle)
         settings_layout.addWidget((QLabel("Select Monitor to Screenshot:")))
         settings_layout.addWidget(self.monitor_dropdown)
         settings_layout.addWidget(self.replay_tutorial_button)
@@ -211,7 +216,10 @@ class ServerGUI(QMainWindow):
     def on_device_disconnected(self):
         if self._is_shutting_down:
             return
+        device = self.connected_device
         self.connected_device = None
+        if device is not None:
+            asyncio.create_task(self._release_device(device))
         self.send_file_button.setEnabled(False)
         self.start_trail_button.setEnabled(False)
         self.stop_trail_button.setEnabled(False)
@@ -221,6 +229,13 @@ class ServerGUI(QMainWindow):
         QMessageBox.critical(self, "Disconnected", "The BLE device disconnected unexpectedly.")
 
 
+    async def _release_device(self, device):
+        #The link is gone for good, stop the worker threads the dropped device still runs
+        try:
+            await device.disconnect()
+        except Exception as e:
+            print(f"Cleanup after disconnect: {e}")
+
     async def scan_for_devices(self):
         self.status_label.setText("Status: Scanning....")
         self.scan_button.setEnabled(False)
@@ -255,6 +270,9 @@ class ServerGUI(QMainWindow):
         device = DeviceBLE()
         device.address = address
         device.on_disconnect = self.on_device_disconnected
+        device.auto_reconnect = bool(AppSettings.get("auto_reconnect", False))
+        device.on_reconnecting = lambda: self.set_status("Link lost, reconnecting...", "busy")
+        device.on_reconnected = lambda: self.set_status(f"Reconnected after {device.last_downtime:.1f}s", "ok")
         device.socketHandler.on_trail_state_changed = self.set_trail_state
         try:
 
@@ -273,6 +291,11 @@ class ServerGUI(QMainWindow):
         except Exception as e:
             self.status_label.setText(f"Status: Error -{e}")
             self.connect_button.setEnabled(True)
+            #This device is dropped, stop the worker threads it started
+            try:
+                await device.disconnect()
+            except Exception as cleanup_error:
+                print(f"Cleanup after failed connect: {cleanup_error}")
 
     async def run_websocket_server(self, device):
         try:
@@ -333,6 +356,12 @@ class ServerGUI(QMainWindow):
     def on_emulation_toggled(self, state):
         config.emulation_state.enabled = (state == 2)
 
+    def on_reconnect_toggled(self, state):
+        enabled = (state == 2)
+        AppSettings.set("auto_reconnect", enabled)
+        if self.connected_device:
+            self.connected_device.auto_reconnect = enabled
+
     def _on_emulation_state_changed(self, enabled: bool):
         self.emulation_toggle.blockSignals(True)
         self.emulation_toggle.setChecked(enabled)
@@ -404,7 +433,7 @@ class ServerGUI(QMainWindow):
     async def shutdown_routine(self):
         try:
             print("Disconnecting BLE to prevent notification crash.")
-            await self.connected_device.client.disconnect()
+            await self.connected_device.disconnect()
             self.connected_device = None
         except Exception as e:
             print(f"Disconnecting Error: {e}")
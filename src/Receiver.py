@@ -7,6 +7,9 @@ from DeviceBLE import DeviceBLE
 
 INPUT_SERVICE_UUID = "0000feed-0000-1000-8000-00805f9b34fb"
 MAX_PITCH = 1.57079633
+BASE_PORT = 9999
+RETRY_DELAY = 2.0
+MAX_RETRY_DELAY = 30.0
 
 
 async def discover():
@@ -21,44 +24,72 @@ async def discover():
     return results
 
 
+async def run_server(device):
+    #One websocket server per controller, each on its own port
+    try:
+        async with websockets.serve(
+                device.socketHandler.handle_websocket,
+                device.socketHandler.url,
+                device.socketHandler.port
+        ):
+            await asyncio.Future()
+    except OSError as e:
+        print(f"[{device.address}] WebSocket Error: {e}")
+
+
+async def run_device(device):
+    #Keeps one controller connected, a failure here never touches the other devices
+    delay = RETRY_DELAY
+    while True:
+        lost = asyncio.Event()
+        device.on_disconnect = lost.set
+        try:
+            await device.connect()
+            await device.notify()
+            await device.start_heartbeat_loop()
+        except Exception as e:
+            print(f"[{device.address}] {e}, retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+            continue
+
+        delay = RETRY_DELAY
+        print(f"[{device.address}] ready, websocket on port {device.socketHandler.port}")
+        await lost.wait()
+        print(f"[{device.address}] disconnected, reconnecting")
+
+
 async def main():
     scan = await discover()
     connectedDevices = []
 
-    for address in scan:
-        d = DeviceBLE()
+    for i, address in enumerate(scan):
+        d = DeviceBLE(ws_port=BASE_PORT + i)
         d.address = address
+        #Link drops are healed inside DeviceBLE, run_device only sees a disconnect if that gives up
+        d.auto_reconnect = True
         connectedDevices.append(d)
 
-
-    async def run_device(device):
-        async def runServer():
-                async with websockets.serve(
-                        device.socketHandler.handle_websocket,
-                        device.socketHandler.url,
-                        device.socketHandler.port
-                ):
-                    await asyncio.Future()
-
-        asyncio.create_task(runServer())
-        await device.connect()
-        await device.notify()
-
-        #await device.send_file("SuperTuxKart.json")
-
+    if not connectedDevices:
+        print("Did not find available devices")
+        return
 
     try:
-        for d in connectedDevices:
-            await run_device(d)
-        while True:
-            await asyncio.sleep(1)
+        #Connect every controller at once, connect time no longer grows with the number of phones
+        await asyncio.gather(
+            *(run_server(d) for d in connectedDevices),
+            *(run_device(d) for d in connectedDevices)
+        )
     except KeyboardInterrupt:
         print("Stopping...")
     except Exception as e:
         print(f"Error: {e}")
     finally:
         for d in connectedDevices:
-            await d.disconnect()
+            try:
+                await d.disconnect()
+            except Exception as e:
+                print(f"[{d.address}] {e}")
 
 
-asyncio.run(main())
\ No newline at end of file
+asyncio.run(main())
@@ -0,0 +1,85 @@
+import datetime
+import os
+import struct
+import sys
+import time
+
+# Append-only session log: a file header, then records of (kind, seconds since start, payload length) + payload.
+# Input frames are stored as they arrived (JSON text after chunk reassembly, or the binary frame), so a
+# replay goes through the same decoders as a live session.
+SESSION_MAGIC = b"BLESESS1"
+RECORD_HEADER = struct.Struct("<BdI")
+
+KIND_INPUT_JSON = 1
+KIND_INPUT_BINARY = 2
+KIND_BUTTONS = 3        # comma separated button names for the binary frames that follow
+KIND_PAUSE = 4
+KIND_STEP = 5
+KIND_SCREENSHOT = 6
+EVENT_KINDS = {KIND_PAUSE: "pause", KIND_STEP: "step", KIND_SCREENSHOT: "screenshot"}
+
+
+def get_sessions_dir():
+    if getattr(sys, "frozen", False):
+        base = os.path.dirname(sys.executable)
+    else:
+        base = os.path.dirname(os.path.abspath(__file__))
+
+    sessions_dir = os.path.join(base, "sessions")
+    os.makedirs(sessions_dir, exist_ok=True)
+    return sessions_dir
+
+
+class SessionRecorder:
+    """Appends input frames and controller events to a session log, called from the BLE callbacks."""
+
+    def __init__(self, path=None, button_names=None):
+        if path is None:
+            stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(get_sessions_dir(), f"session_{stamp}.blesession")
+        self.path = path
+        self.records = 0
+        #Buffered, a record is a memory copy and the OS write happens once the buffer fills
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(SESSION_MAGIC)
+        self._start = time.perf_counter()
+        if button_names is not None:
+            self.buttons(button_names, self._start)
+
+    def _write(self, kind, payload, at):
+        self._file.write(RECORD_HEADER.pack(kind, at - self._start, len(payload)))
+        self._file.write(payload)
+        self.records += 1
+
+    def input_json(self, text, at):
+        self._write(KIND_INPUT_JSON, text.encode("utf-8"), at)
+
+    def input_binary(self, data, at):
+        self._write(KIND_INPUT_BINARY, bytes(data), at)
+
+    def buttons(self, names, at):
+        self._write(KIND_BUTTONS, ",".join(names).encode("utf-8"), at)
+
+    def event(self, kind, at):
+        self._write(kind, b"", at)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_session(path):
+    #Yields (kind, seconds since start, payload); a record cut short by a crash ends the session
+    with open(path, "rb") as f:
+        if f.read(len(SESSION_MAGIC)) != SESSION_MAGIC:
+            raise ValueError(f"{path} is not a session log")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            kind, at, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield kind, at, payload
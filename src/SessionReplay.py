@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import json
+import time
+
+from src.InputFrame import InputFrame, toggle_keys
+from src.SessionLog import EVENT_KINDS, KIND_BUTTONS, KIND_INPUT_BINARY, KIND_INPUT_JSON, KIND_PAUSE, read_session
+
+# At max speed the replay yields to the event loop every this many frames so websocket senders keep up
+YIELD_EVERY = 64
+PAUSE_HOLD = 0.1
+
+
+class SessionReplay:
+    """Feeds a recorded session back through GamepadManager and SocketHandler.
+
+    speed 1.0 keeps the recorded timing, 2.0 plays twice as fast, 0 plays as fast as possible.
+    """
+
+    def __init__(self, gamepad_manager=None, socket_handler=None, speed=1.0):
+        self.gamepad_manager = gamepad_manager
+        self.socket_handler = socket_handler
+        self.speed = speed
+        self.frames = 0
+        self.events = 0
+        self.elapsed = 0.0
+
+    async def play(self, records):
+        button_keys = None
+        start = time.perf_counter()
+        for kind, at, payload in records:
+            if self.speed:
+                delay = start + at / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif self.frames % YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+            if kind == KIND_INPUT_JSON:
+                frame = InputFrame.from_json(payload.decode("utf-8"))
+            elif kind == KIND_INPUT_BINARY:
+                frame = InputFrame.from_binary(payload, button_keys) if button_keys is not None else None
+            elif kind == KIND_BUTTONS:
+                button_keys = toggle_keys(payload.decode("utf-8").split(",") if payload else [])
+                continue
+            elif kind in EVENT_KINDS:
+                self._event(kind)
+                continue
+            else:
+                continue
+            if frame is None:
+                continue
+
+            self.frames += 1
+            if self.gamepad_manager is not None:
+                self.gamepad_manager.update_state(frame)
+            if self.socket_handler is not None:
+                self.socket_handler.on_input_frame(frame)
+        self.elapsed += time.perf_counter() - start
+
+    def _event(self, kind):
+        self.events += 1
+        if self.socket_handler is not None:
+            self.socket_handler.addMessage(json.dumps({"type": EVENT_KINDS[kind]}))
+        if kind == KIND_PAUSE and self.gamepad_manager is not None:
+            self.gamepad_manager.pulse_event("toggle:pause", PAUSE_HOLD / self.speed if self.speed else 0)
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "events": self.events,
+            "elapsed_s": round(self.elapsed, 3),
+            "frames_per_s": round(self.frames / self.elapsed) if self.elapsed else None,
+        }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded controller session without a phone")
+    parser.add_argument("session")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 0 for as fast as possible")
+    parser.add_argument("--loops", type=int, default=1)
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--no-gamepad", action="store_true", help="only relay to websocket clients")
+    args = parser.parse_args()
+
+    import websockets
+    from DeviceBLE import DeviceBLE
+
+    #A DeviceBLE that never connects, it owns the same GamepadManager and SocketHandler a live session uses
+    device = DeviceBLE(ws_port=args.port)
+    records = list(read_session(args.session))
+    replay = SessionReplay(None if args.no_gamepad else device.gamepadManager, device.socketHandler, args.speed)
+    async with websockets.serve(device.socketHandler.handle_websocket, device.socketHandler.url, args.port):
+        for _ in range(args.loops):
+            await replay.play(records)
+            print(replay.stats())
+    await device.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
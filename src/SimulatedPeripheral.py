@@ -0,0 +1,293 @@
+import asyncio
+import json
+import random
+import time
+import zlib
+
+from src.FileTransfer import BLOCK_HEADER, CRC32, FEATURE_HASH, FEATURE_SEQ, FEATURE_ZLIB, XFER_HELLO, XFER_PREFIX, \
+    content_hash
+from src.InputProtocol import BINARY_FRAME_VERSION, BINARY_FRAME_VERSION_TS, PROTO_PREFIX, PROTO_REQUEST, encode_frame
+
+# Same UUIDs DeviceBLE subscribes to, repeated here so the simulator does not import bleak through DeviceBLE
+INPUT_CHAR_UUID = "0000beef-0000-1000-8000-00805f9b34fb"
+FILE_TRANSFER_CHAR_UUID = "efcdbf7b-fee2-489b-8f79-b649aa50619b"
+CONTROL_MESSAGE_CHAR_UUID = "4a55006e-990a-4737-9634-133466ef8e35"
+PAUSE_UUID = "446be5b0-93b7-4911-abbe-e4e18d545640"
+SCREENSHOT_UUID = "36d942a6-9e79-4812-8a8f-84a275f6b176"
+HEARTBEAT_UUID = "a5307aef-3109-42f7-b79e-a493856823ba"
+STEP_UUID = "c36f600d-a202-48cd-a839-7577abea4b1f"
+CHARACTERISTICS = (INPUT_CHAR_UUID, FILE_TRANSFER_CHAR_UUID, CONTROL_MESSAGE_CHAR_UUID, PAUSE_UUID, SCREENSHOT_UUID,
+                   HEARTBEAT_UUID, STEP_UUID)
+ATT_HEADER = 3
+
+
+class SimulatedCharacteristic:
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self.handle = handle
+
+
+class SimulatedServices:
+    def __init__(self):
+        self._by_uuid = {}
+        self._by_handle = {}
+        for i, uuid in enumerate(CHARACTERISTICS):
+            characteristic = SimulatedCharacteristic(uuid, 0x10 + i * 2)
+            self._by_uuid[uuid] = characteristic
+            self._by_handle[characteristic.handle] = characteristic
+
+    def get_characteristic(self, specifier):
+        if isinstance(specifier, SimulatedCharacteristic):
+            return specifier
+        if isinstance(specifier, int):
+            return self._by_handle.get(specifier)
+        return self._by_uuid.get(str(specifier).lower())
+
+
+class SimulatedPeripheral:
+    """In-process stand-in for the Android app, speaking the same GATT protocol DeviceBLE does.
+
+    Answers the control characteristic (PROTO, XFER:HELLO, HAVE, START, WINDOW, CHECKSUM, END) and the
+    heartbeat, and can push input frames and events at a chosen rate. `mtu` limits every write,
+    `packets_per_second` throttles writes without response like a connection interval would, `loss`
+    and `corrupt` drop or damage those writes, and `latency` delays every notification.
+
+    Hand `client_factory` to DeviceBLE in place of BleakClient.
+    """
+
+    def __init__(self, mtu=247, packets_per_second=None, loss=0.0, corrupt=0.0, latency=0.0,
+                 features=(FEATURE_SEQ, FEATURE_ZLIB, FEATURE_HASH), button_names=None, timestamps=False, seed=1):
+        self.mtu = mtu
+        self.packets_per_second = packets_per_second
+        self.loss = loss
+        self.corrupt = corrupt
+        self.latency = latency
+        self.features = tuple(features)
+        #None keeps the app on JSON input frames
+        self.button_names = button_names
+        #Binary frames carry the sender clock (frame version 2)
+        self.timestamps = timestamps
+        self.answer_heartbeat = True
+        self._rng = random.Random(seed)
+        self.client = None
+        #Files the "phone" has saved, by name, and the content hashes it could load without a transfer
+        self.files = {}
+        self.hashes = set()
+        self.packets_written = 0
+        self.packets_lost = 0
+        self.bytes_written = 0
+        self._reset_transfer()
+
+    def client_factory(self, address, disconnected_callback=None):
+        self.client = SimulatedClient(self, address, disconnected_callback)
+        return self.client
+
+    def _reset_transfer(self):
+        self._name = None
+        self._raw_length = None
+        self._block_count = None
+        self._blocks = {}
+        self._chunks = []
+
+    #Host -> phone
+
+    def on_write(self, uuid, data):
+        if uuid == CONTROL_MESSAGE_CHAR_UUID:
+            reply = self._control(bytes(data).decode("utf-8"))
+            if reply is not None:
+                self.notify(CONTROL_MESSAGE_CHAR_UUID, reply.encode("utf-8"))
+        elif uuid == FILE_TRANSFER_CHAR_UUID:
+            self._receive(bytes(data))
+        elif uuid == HEARTBEAT_UUID and self.answer_heartbeat:
+            message = bytes(data).decode("utf-8")
+            self.notify(HEARTBEAT_UUID, message.replace("PING", "PONG", 1).encode("utf-8"))
+
+    def _control(self, message):
+        if message == PROTO_REQUEST:
+            if self.button_names is None:
+                return None
+            version = BINARY_FRAME_VERSION_TS if self.timestamps else BINARY_FRAME_VERSION
+            return f"{PROTO_PREFIX}{version}:{','.join(self.button_names)}"
+        if message == XFER_HELLO:
+            return f"{XFER_PREFIX}{','.join(self.features)}" if self.features else None
+        if message.startswith("HAVE:"):
+            return "HAVE" if message[5:] in self.hashes else "MISS"
+        if message.startswith("START:"):
+            self._reset_transfer()
+            parts = message.split(":")
+            self._name = parts[1]
+            if "SEQ" in parts:
+                self._block_count = int(parts[parts.index("SEQ") + 2])
+            if "ZLIB" in parts:
+                self._raw_length = int(parts[parts.index("ZLIB") + 1])
+            return None
+        if message.startswith("WINDOW:"):
+            _, base, count = message.split(":")
+            base, count = int(base), int(count)
+            mask = 0
+            for i in range(count):
+                if base + i not in self._blocks:
+                    mask |= 1 << i
+            return f"NACK:{base}:{mask:x}" if mask else "ACK"
+        if message.startswith("CHECKSUM:"):
+            if CRC32(self._payload()) == int(message[9:]):
+                return "OK"
+            self._chunks = []
+            return "RESEND"
+        if message == "END":
+            data = self._payload()
+            if self._raw_length is not None:
+                data = zlib.decompress(data)
+            self.files[self._name] = data
+            self.hashes.add(content_hash(data))
+            self._reset_transfer()
+        return None
+
+    def _receive(self, data):
+        if self._block_count is None:
+            self._chunks.append(data)
+            return
+        #A damaged block fails its own CRC and is simply missing, the next WINDOW NACKs it
+        seq, crc = BLOCK_HEADER.unpack_from(data)
+        payload = data[BLOCK_HEADER.size:]
+        if CRC32(payload) == crc:
+            self._blocks[seq] = payload
+
+    def _payload(self):
+        if self._block_count is None:
+            return b"".join(self._chunks)
+        return b"".join(self._blocks.get(seq, b"") for seq in range(self._block_count))
+
+    #Phone -> host
+
+    def notify(self, uuid, data):
+        client = self.client
+        if client is None or not client.is_connected:
+            return
+        callback = client.callbacks.get(uuid)
+        if callback is None:
+            return
+        characteristic = client.services.get_characteristic(uuid)
+        loop = asyncio.get_running_loop()
+        if self.latency:
+            loop.call_later(self.latency, callback, characteristic, bytearray(data))
+        else:
+            loop.call_soon(callback, characteristic, bytearray(data))
+
+    def input_packets(self, pressed, pitch=0.0, roll=0.0, stepping=False):
+        #One frame as the app would notify it: a binary frame, or JSON split into START/CHUNK/END when it exceeds the MTU
+        if self.button_names is not None:
+            sent_ms = int(time.monotonic() * 1000) if self.timestamps else None
+            return [encode_frame(pressed, pitch, roll, stepping, sent_ms)]
+        text = json.dumps({
+            "buttons": [{"name": f"Button {i}", "pressed": p} for i, p in enumerate(pressed)],
+            "stepping": stepping, "pitch": pitch, "roll": roll,
+        })
+        room = self.mtu - ATT_HEADER - 16
+        if len(text) <= self.mtu - ATT_HEADER:
+            return [text.encode("utf-8")]
+        parts = [text[i:i + room] for i in range(0, len(text), room)]
+        packets = [f"START:{len(parts)}:{parts[0]}"]
+        packets += [f"CHUNK:{i}:{part}" for i, part in enumerate(parts[1:-1], 1)]
+        packets.append(f"END:{parts[-1]}")
+        return [packet.encode("utf-8") for packet in packets]
+
+    async def stream_inputs(self, frames, rate_hz=None):
+        #frames is a list of input_packets() results, rate_hz None sends them back to back
+        interval = 1 / rate_hz if rate_hz else 0
+        start = time.perf_counter()
+        for i, packets in enumerate(frames):
+            if interval:
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 64 == 0:
+                await asyncio.sleep(0)
+            for data in packets:
+                self.notify(INPUT_CHAR_UUID, data)
+        await asyncio.sleep(self.latency)
+
+    def pause(self):
+        self.notify(PAUSE_UUID, b"1")
+
+    def step(self):
+        self.notify(STEP_UUID, b"1")
+
+    def screenshot(self):
+        self.notify(SCREENSHOT_UUID, b"1")
+
+    def drop_link(self):
+        if self.client is not None:
+            self.client.lose_link()
+
+
+class SimulatedClient:
+    """The subset of bleak.BleakClient DeviceBLE uses, backed by a SimulatedPeripheral."""
+
+    def __init__(self, peripheral, address, disconnected_callback=None):
+        self.peripheral = peripheral
+        self.address = address
+        self._disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.services = SimulatedServices()
+        self.callbacks = {}
+        self._next_send = 0.0
+
+    @property
+    def mtu_size(self):
+        return self.peripheral.mtu
+
+    async def connect(self):
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        self.is_connected = False
+        self.callbacks = {}
+        return True
+
+    def lose_link(self):
+        self.is_connected = False
+        self.callbacks = {}
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+    async def start_notify(self, specifier, callback):
+        characteristic = self._characteristic(specifier)
+        self.callbacks[characteristic.uuid] = callback
+
+    async def write_gatt_char(self, specifier, data, response=False):
+        if not self.is_connected:
+            raise Exception("Not connected")
+        characteristic = self._characteristic(specifier)
+        peripheral = self.peripheral
+        if len(data) > peripheral.mtu - ATT_HEADER:
+            raise ValueError(f"Write of {len(data)} bytes does not fit MTU {peripheral.mtu}")
+        peripheral.packets_written += 1
+        peripheral.bytes_written += len(data)
+        if not response:
+            await self._throttle()
+            if peripheral.loss and peripheral._rng.random() < peripheral.loss:
+                peripheral.packets_lost += 1
+                return
+            if peripheral.corrupt and peripheral._rng.random() < peripheral.corrupt:
+                data = bytearray(data)
+                data[-1] ^= 0xFF
+        peripheral.on_write(characteristic.uuid, data)
+
+    async def _throttle(self):
+        rate = self.peripheral.packets_per_second
+        if not rate:
+            return
+        #Each write takes the next free slot, sleeps are batched since asyncio cannot wait for microseconds
+        now = time.perf_counter()
+        slot = max(self._next_send, now)
+        self._next_send = slot + 1 / rate
+        if slot - now > 0.001:
+            await asyncio.sleep(slot - now)
+
+    def _characteristic(self, specifier):
+        characteristic = self.services.get_characteristic(specifier)
+        if characteristic is None:
+            raise ValueError(f"Characteristic {specifier} not found")
+        return characteristic
@@ -1,5 +1,6 @@
 import asyncio
 import base64
+import binascii
 import datetime
 import json
 import os
@@ -7,48 +8,110 @@ import tempfile
 
 import websockets
 
+from src.ClientQueue import BLOCK, ClientQueue
 from src.config import emulation_state
 from src.GPX.GPXManager import GPXManager
-from src.GPX.ScreenshotHelper import save_screenshot_with_exif
+from src.GPX.ScreenshotHelper import jpeg_with_exif
+from src.InputFrame import InputFrame
+from src.LatencyTrace import STAGE_WEBSOCKET
+from src.WireFormat import ENCODING_JSON, ENCODING_MSGPACK, TAG_MSGPACK, TAG_PHOTO, PhotoResponse, available_encodings, \
+    msgpack, photo_image, unpack
+from src.XboxMapper.ProfileStore import DEFAULT_PROFILE
+
+# Topics a client can subscribe to, clients that never send a subscribe message get all of them
+TOPIC_INPUT = "input"
+TOPIC_EVENTS = "events"
+TOPIC_PHOTO = "photo"
+TOPIC_GPX = "gpx"
+TOPIC_STATS = "stats"
+TOPICS = {TOPIC_INPUT, TOPIC_EVENTS, TOPIC_PHOTO, TOPIC_GPX, TOPIC_STATS}
 
 
 class SocketHandler:
-    def __init__(self, ble_device):
+    def __init__(self, ble_device, port = 9999):
         self.url = "localhost"
-        self.port = 9999
-        self.queue = asyncio.Queue()
+        self.port = port
+        #Every connected client gets its own bounded queue, a message is serialized once and shared by all of them
+        self.client_queue_size = 256
+        self.response_policy = BLOCK
+        #How long a BLOCK response waits for a full client before that client is disconnected
+        self.response_timeout = 2.0
+        self.clients = {}
         self.ble_device = ble_device
         self.on_trail_state_changed = None
 
     async def handle_websocket(self,websocket):
+        client_queue = ClientQueue(self.client_queue_size)
+        self.clients[websocket] = client_queue
+
         async def sender():
-            while True:
-                message = await self.queue.get()
-                await websocket.send(message)
+            try:
+                while True:
+                    message = await client_queue.get()
+                    try:
+                        encoded = self.encode_for(client_queue, message)
+                    except Exception as e:
+                        #One message that cannot be encoded is skipped, the connection keeps going
+                        print(f"[sender] dropping a message that failed to encode: {e}")
+                        continue
+                    await websocket.send(encoded)
+                    tracer = self.ble_device.tracer
+                    if tracer.enabled and isinstance(message, InputFrame):
+                        tracer.record(STAGE_WEBSOCKET, message.received_at)
+            except websockets.ConnectionClosed:
+                pass
 
         async def receiver():
             async for message in websocket:
                 print(f"[receiver] raw message prefix: {message[:60]}")
                 try:
-                    data = json.loads(message)
-                    msg_type = data.get("type")
-                except(json.JSONDecodeError, AttributeError):
-                    msg_type = "layout"
-                    data = {"payload": message}
+                    msg_type, data = self.decode_message(message)
+                except ValueError as e:
+                    #A malformed frame is answered, the connection stays open
+                    client_queue.push(json.dumps({"type": "error", "message": str(e)}))
+                    continue
 
                 if msg_type == "layout":
                     self.handle_layout(data, message)
 
+                elif msg_type == "hello":
+                    self.handle_hello(client_queue, data)
+
+                elif msg_type == "subscribe":
+                    self.handle_subscribe(client_queue, data)
+
+                elif msg_type == "get_stats":
+                    client_queue.push(json.dumps(self.stats()))
+
                 elif msg_type == "control":
                     command = data.get("command")
                     if command == "DISABLE_EMULATION":
                         emulation_state.enabled = False
                     elif command == "ENABLE_EMULATION":
                         emulation_state.enabled = True
+                    elif command == "ENABLE_TRACE":
+                        self.ble_device.tracer.enabled = True
+                    elif command == "DISABLE_TRACE":
+                        self.ble_device.tracer.enabled = False
+                    elif command == "RESET_TRACE":
+                        self.ble_device.tracer.reset()
+                    elif command == "START_RECORDING":
+                        path = self.ble_device.start_recording()
+                        client_queue.push(json.dumps({"type": "recording", "active": True, "path": path}))
+                    elif command == "STOP_RECORDING":
+                        self.ble_device.stop_recording()
+                        client_queue.push(json.dumps({"type": "recording", "active": False}))
+                    elif command == "SET_PROFILE":
+                        await self.handle_set_profile(client_queue, data)
+                    elif command == "LIST_PROFILES":
+                        self.ble_device.gamepadManager.profiles.refresh()
+                        client_queue.push(json.dumps(self.profile_status()))
+                    elif command == "BIND_PROFILE":
+                        self.handle_bind_profile(client_queue, data)
 
 
                 elif msg_type == "photo_upload":
-                    asyncio.create_task(self.handle_photo(data))
+                    asyncio.create_task(self.handle_photo(client_queue, data))
 
                 elif msg_type == "gpx_point":
                     self.handle_gpx_point(data)
@@ -57,7 +120,7 @@ class SocketHandler:
                     self.handle_gpx_start(data)
 
                 elif msg_type == "gpx_stop":
-                    await self.handle_gpx_stop(data)
+                    self.handle_gpx_stop(data)
 
                 elif msg_type == "gpx_release":
                     self.ble_device.gpx_manager = None
@@ -65,53 +128,164 @@ class SocketHandler:
                 else:
                     print(f"[receiver] unhandled message type: {msg_type}")
 
+        #The receiver ends when the client goes away, the sender would otherwise wait on its queue forever
+        sender_task = asyncio.create_task(sender())
         try:
-            await asyncio.gather(sender(),receiver())
+            await receiver()
         except websockets.ConnectionClosed:
             pass
+        finally:
+            sender_task.cancel()
+            del self.clients[websocket]
+            client_queue.close()
+
+    @staticmethod
+    def decode_message(message):
+        """(message type, fields) of one websocket frame, raises ValueError for a frame that cannot be read."""
+        if isinstance(message, bytes):
+            tag = message[:1]
+            if tag == bytes((TAG_PHOTO,)):
+                #Binary upload, same layout as the response and the image bytes arrive without base64
+                image = photo_image(message)
+                if image is None:
+                    raise ValueError("photo frame without a flags byte")
+                return "photo_upload", {"image": image}
+            if tag == bytes((TAG_MSGPACK,)) and msgpack is not None:
+                try:
+                    data = unpack(message)
+                except (ValueError, TypeError) as e:
+                    raise ValueError(f"unreadable msgpack frame ({type(e).__name__})")
+                if not isinstance(data, dict):
+                    raise ValueError("msgpack frame is not a map")
+                return data.get("type"), data
+            #Any other binary frame can only be layout text
+            try:
+                message = message.decode("utf-8")
+            except UnicodeDecodeError:
+                raise ValueError("binary frame with an unknown tag")
+        try:
+            data = json.loads(message)
+            return data.get("type"), data
+        except(json.JSONDecodeError, AttributeError):
+            return "layout", {"payload": message}
+
+    def handle_hello(self, client_queue, data):
+        #Per connection content negotiation, anything unsupported falls back to JSON text
+        encoding = data.get("encoding", ENCODING_JSON)
+        client_queue.encoding = encoding if encoding in available_encodings() else ENCODING_JSON
+        client_queue.binary_images = bool(data.get("binary_images", False))
+        client_queue.push(json.dumps({
+            "type": "hello",
+            "encoding": client_queue.encoding,
+            "binary_images": client_queue.binary_images,
+            "available_encodings": available_encodings()
+        }))
+
+    def handle_subscribe(self, client_queue, data):
+        topics = data.get("topics")
+        max_rate = data.get("max_input_rate")
+        #A bad subscribe is answered with an error and leaves the current subscription as it was
+        if topics is not None and (not isinstance(topics, list) or not all(isinstance(t, str) for t in topics)):
+            client_queue.push(json.dumps({"type": "error", "message": "topics must be a list of topic names"}))
+            return
+        if max_rate is not None and (isinstance(max_rate, bool) or not isinstance(max_rate, (int, float)) or not max_rate >= 0):
+            client_queue.push(json.dumps({"type": "error", "message": "max_input_rate must be a non-negative number"}))
+            return
+        if topics is not None:
+            unknown = set(topics) - TOPICS
+            if unknown:
+                print(f"[subscribe] ignoring unknown topics: {', '.join(sorted(unknown))}")
+            client_queue.topics = set(topics) & TOPICS
+        client_queue.min_input_interval = 1.0 / max_rate if max_rate else 0.0
+        client_queue.push(json.dumps({
+            "type": "subscribed",
+            "topics": sorted(client_queue.topics if client_queue.topics is not None else TOPICS),
+            "max_input_rate": max_rate
+        }))
+
+    async def handle_set_profile(self, client_queue, data):
+        gamepad = self.ble_device.gamepadManager
+        name = data.get("profile") or DEFAULT_PROFILE
+        if not isinstance(name, str):
+            client_queue.push(json.dumps({"type": "error", "message": "profile must be a profile name"}))
+            return
+        #Cached profiles swap straight away, others are parsed on a worker thread first
+        if not gamepad.switch_profile(name):
+            try:
+                await asyncio.to_thread(gamepad.load_profile, name)
+            except (OSError, KeyError, ValueError, TypeError, AttributeError) as e:
+                client_queue.push(json.dumps({"type": "error", "message": f"Could not load profile {name}: {e}"}))
+                return
+        client_queue.push(json.dumps(self.profile_status()))
+
+    def handle_bind_profile(self, client_queue, data):
+        #Binds a profile to the layout that was sent last (or to the given hash)
+        profiles = self.ble_device.gamepadManager.profiles
+        layout_hash = data.get("layout_hash") or self.ble_device.layout_hash
+        name = data.get("profile")
+        try:
+            if layout_hash is None:
+                raise ValueError("no layout has been sent yet")
+            if not isinstance(layout_hash, str) or not isinstance(name, str):
+                raise ValueError("profile and layout_hash must be strings")
+            profiles.bind_layout(layout_hash, name)
+        except (OSError, ValueError) as e:
+            client_queue.push(json.dumps({"type": "error", "message": f"Could not bind profile: {e}"}))
+            return
+        client_queue.push(json.dumps(self.profile_status()))
+
+    def profile_status(self):
+        gamepad = self.ble_device.gamepadManager
+        return {
+            "type": "profiles",
+            "active": gamepad.active_profile,
+            "profiles": sorted(gamepad.profiles.names | {DEFAULT_PROFILE}),
+            "layouts": gamepad.profiles.by_layout,
+        }
 
     def handle_layout(self,data, raw_message):
         payload = data.get("payload", raw_message)
+        if not isinstance(payload, str):
+            print("[handle_layout] ignoring a layout that is not text")
+            return
         filename = "layout.layout"
         with open(filename, "w") as f:
             f.write(payload)
         print("Layout file received")
         asyncio.create_task(self.ble_device.layout_received(filename))
 
-    async def handle_photo(self, data):
+    async def handle_photo(self, client_queue, data):
         print("[handle_photo] entered")
-        raw_data = data.get("data", "")
-        if not raw_data:
+        raw_data = data.get("data") or None
+        img_bytes = data.get("image")
+        if img_bytes is None and raw_data is None:
             return
+        if img_bytes is None:
+            #Decoded on every path, so a bad upload is answered here and never reaches a client's sender
+            try:
+                img_bytes = base64.b64decode(raw_data)
+            except (binascii.Error, TypeError, ValueError) as e:
+                client_queue.push(json.dumps({"type": "error", "message": f"photo_upload data is not valid base64: {e}"}))
+                return
 
-        img_bytes = base64.b64decode(raw_data)
-
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-            tmp.write(img_bytes)
-            png_path = tmp.name
-
-        jpg_path = png_path.replace(".png", ".jpg")
-        jpg_b64 = raw_data
+        response = None
         gpx = self.ble_device.gpx_manager
         if gpx is not None:
             lat, lon = gpx.current_position()
             print(f"[handle_photo] tagging with GPS {lat},{lon}")
             try:
-                save_screenshot_with_exif(png_path, jpg_path, lat, lon)
+                #Tag and re-encode in memory, off the event loop
+                jpg_bytes = await asyncio.to_thread(jpeg_with_exif, img_bytes, lat, lon)
                 print("[handle_photo] exif save done")
             except Exception as e:
                 print(f"[handle_photo] exif failed: {e}")
-                jpg_b64 = raw_data
             else:
-                with open(jpg_path, "rb") as f:
-                    jpg_b64 = base64.b64encode(f.read()).decode("utf-8")
-                os.remove(jpg_path)
-
-        self.addMessage(json.dumps({
-            "type": "photo_response",
-            "data": jpg_b64,
-            "has_gps": gpx is not None
-        }))
+                response = PhotoResponse(jpg_bytes, True)
+
+        if response is None:
+            #Untouched image, a base64 upload is echoed back without another encode pass
+            response = PhotoResponse(img_bytes, gpx is not None, b64=raw_data)
+        await self.publish(TOPIC_PHOTO, response)
 
 
     def handle_gpx_start(self,data):
@@ -138,7 +312,7 @@ class SocketHandler:
         if lat is not None and lon is not None:
             gpx.add_point(lat, lon)
 
-    async def handle_gpx_stop(self,data):
+    def handle_gpx_stop(self,data):
         gpx = self.ble_device.gpx_manager
         if gpx is None:
             return
@@ -155,12 +329,74 @@ class SocketHandler:
             "type": "gpx_response",
             "gpx_xml": gpx_xml
         })
-        self.addMessage(response)
+        #Delivered in the background, the receiver must not wait on other clients' queues
+        asyncio.create_task(self.publish(TOPIC_GPX, response))
 
         self.ble_device.gpx_manager = None
         self.ble_device.gpx_external_control = False
         print("GPX control returned from Godot")
 
 
-    def addMessage(self,message):
-         self.queue.put_nowait(message)
\ No newline at end of file
+    def on_input_frame(self, frame):
+        #Queued as the frame itself, the sender serializes it once per encoding and only if some client takes it
+        #Rate limited clients get a downsampled stream
+        now = frame.received_at
+        for client_queue in self.clients.values():
+            if not client_queue.wants(TOPIC_INPUT):
+                continue
+            if client_queue.min_input_interval:
+                if now - client_queue.last_input_at < client_queue.min_input_interval:
+                    continue
+                client_queue.last_input_at = now
+            client_queue.push(frame)
+
+    def encode_for(self, client_queue, message):
+        if isinstance(message, str):
+            return message
+        if isinstance(message, PhotoResponse):
+            return message.to_binary() if client_queue.binary_images else message.to_json()
+        if client_queue.encoding == ENCODING_MSGPACK:
+            return message.to_msgpack()
+        return message.to_json()
+
+    def addMessage(self, message, topic=TOPIC_EVENTS):
+        #Telemetry, a slow client loses its oldest messages instead of growing without bound
+        for client_queue in self.clients.values():
+            if client_queue.wants(topic):
+                client_queue.push(message)
+
+    async def publish(self, topic, message, policy=None):
+        #Responses that must not be dropped wait for each client to have room, all clients at once and
+        #for at most response_timeout; a client still full by then is not reading and gets disconnected
+        policy = policy or self.response_policy
+        puts = [self._put(websocket, client_queue, message, policy)
+                for websocket, client_queue in list(self.clients.items())
+                if client_queue.wants(topic) and not client_queue.closed]
+        if puts:
+            await asyncio.gather(*puts)
+
+    async def _put(self, websocket, client_queue, message, policy):
+        try:
+            await asyncio.wait_for(client_queue.put(message, policy), self.response_timeout)
+        except asyncio.TimeoutError:
+            print(f"[publish] client {websocket.remote_address} stopped reading, disconnecting it")
+            client_queue.close()
+            #The close handshake with a stalled client can take a while, nobody waits for it
+            asyncio.create_task(websocket.close(code=1013, reason="client too slow"))
+
+    def stats(self):
+        device = self.ble_device
+        gamepad = device.gamepadManager
+        return {
+            "type": "stats",
+            "tracing": device.tracer.enabled,
+            "latency": device.tracer.summary(),
+            "link": device.heartbeat_stats(),
+            "gamepad": {"updates_issued": gamepad.updates_issued, "updates_skipped": gamepad.updates_skipped}
+            if gamepad is not None else None,
+            "clients": self.client_stats(),
+        }
+
+    def client_stats(self):
+        return [dict(client_queue.stats(), client=str(websocket.remote_address))
+                for websocket, client_queue in self.clients.items()]
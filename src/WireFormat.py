@@ -0,0 +1,66 @@
+import base64
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Per connection encodings, chosen by the client's "hello" message. JSON text stays the default.
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+
+# Binary websocket frames start with a tag byte saying what follows
+TAG_MSGPACK = 0x01      # a msgpack map, same fields as the JSON message
+TAG_PHOTO = 0x02        # flags byte (bit 0 = has_gps) then the raw image bytes, uploads send flags 0
+PHOTO_HAS_GPS = 0x01
+
+
+def available_encodings():
+    return [ENCODING_JSON, ENCODING_MSGPACK] if msgpack is not None else [ENCODING_JSON]
+
+
+def pack(message):
+    return bytes((TAG_MSGPACK,)) + msgpack.packb(message)
+
+
+def unpack(data):
+    return msgpack.unpackb(memoryview(data)[1:])
+
+
+def photo_image(data):
+    #Image bytes of a TAG_PHOTO frame, None if the frame is too short to hold the flags byte
+    if len(data) < 2:
+        return None
+    return bytes(memoryview(data)[2:])
+
+
+class PhotoResponse:
+    """A photo_response whose JSON (base64) and binary forms are each built once, on first use."""
+    __slots__ = ("image", "has_gps", "_b64", "_json", "_binary")
+
+    def __init__(self, image, has_gps, b64=None):
+        self.image = image
+        self.has_gps = has_gps
+        self._b64 = b64
+        self._json = None
+        self._binary = None
+
+    def to_json(self):
+        if self._json is None:
+            if self._b64 is None:
+                self._b64 = base64.b64encode(self.image).decode("utf-8")
+            self._json = json.dumps({
+                "type": "photo_response",
+                "data": self._b64,
+                "has_gps": self.has_gps
+            })
+        return self._json
+
+    def to_binary(self):
+        if self._binary is None:
+            if self.image is None:
+                self.image = base64.b64decode(self._b64)
+            flags = PHOTO_HAS_GPS if self.has_gps else 0
+            self._binary = bytes((TAG_PHOTO, flags)) + self.image
+        return self._binary
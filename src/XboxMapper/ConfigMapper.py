@@ -11,7 +11,7 @@ from src import AppSettings
 from src.ReadFile import resource_path
 from src.TutorialOverlay import TutorialOverlay
 from src.TutorialSteps import get_config_mapper_steps
-from src.XboxMapper.MapperHelperFunctions import rows_to_config, config_to_rows, get_android_inputs
+from src.XboxMapper.MapperHelperFunctions import rows_to_config, config_to_rows, get_android_inputs, extra_sections
 from src.XboxMapper.RowWidget import RowWidget
 from src.XboxMapper.XboxDictionary import XBOX_CONTROLS, ALWAYS_AVAILABLE, FLOAT_INPUTS
 
@@ -29,6 +29,7 @@ class ConfigMapper(QMainWindow):
         self._layout_data = {}
         self._available_inputs = list(ALWAYS_AVAILABLE) + FLOAT_INPUTS
         self._rows = {k: [] for k, *_ in XBOX_CONTROLS}
+        self._extra_sections = {}
         self._row_widgets = {}
 
         self._build_ui()
@@ -41,6 +42,7 @@ class ConfigMapper(QMainWindow):
             with open(path, "r") as f:
                 config = json.load(f)
             self._rows = config_to_rows(config)
+            self._extra_sections = extra_sections(config)
             self._build_rows()
         except (OSError, json.JSONDecodeError):
             pass
@@ -180,6 +182,7 @@ class ConfigMapper(QMainWindow):
             with open(path, "r") as f:
                 config = json.load(f)
             self._rows = config_to_rows(config)
+            self._extra_sections = extra_sections(config)
             self._build_rows()
             self._status_label.setText(
                 self._status_label.text().split(" | Config:")[0]
@@ -195,7 +198,7 @@ class ConfigMapper(QMainWindow):
         for key, rw in self._row_widgets.items():
             self._rows[key] = rw.get_chips()
 
-        config = rows_to_config(self._rows)
+        config = rows_to_config(self._rows, self._extra_sections)
         output = json.dumps(config, indent = 4)
 
         dialog = QDialog(self)
@@ -0,0 +1,139 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+# inotify(7) constants, the directory is watched so editors that save by writing a temp file and
+# renaming it over config.cfg are seen as well
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+POLL_INTERVAL = 0.5
+# Editors often write a file in several steps, wait for them to settle before reloading
+SETTLE_TIME = 0.05
+
+
+def _load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class ConfigWatcher:
+    """Calls `on_change(path)` from its own thread whenever the file at `path` changes.
+
+    Uses inotify on Linux and falls back to polling the file's size and modification time elsewhere.
+    """
+
+    def __init__(self, path, on_change, poll_interval=POLL_INTERVAL):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.backend = None
+        self.changes = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        fd = self._inotify_fd()
+        self.backend = "inotify" if fd is not None else "poll"
+        target = (lambda: self._run_inotify(fd)) if fd is not None else self._run_poll
+        self._thread = threading.Thread(target=target, name="ConfigWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def _changed(self):
+        self.changes += 1
+        try:
+            self.on_change(self.path)
+        except Exception as e:
+            print(f"Config reload after change failed: {e}")
+
+    def _inotify_fd(self):
+        libc = _load_inotify()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        directory = os.path.dirname(self.path).encode()
+        if libc.inotify_add_watch(fd, directory, IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _run_inotify(self, fd):
+        name = os.path.basename(self.path).encode()
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([fd], [], [], 0.25)
+                if not ready or not self._read_events(fd, name):
+                    continue
+                #Swallow the rest of this save before reloading once
+                while select.select([fd], [], [], SETTLE_TIME)[0]:
+                    self._read_events(fd, name)
+                self._changed()
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _read_events(fd, name):
+        try:
+            data = os.read(fd, 4096)
+        except BlockingIOError:
+            return False
+        hit = False
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _wd, _mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            if data[offset:offset + length].rstrip(b"\0") == name:
+                hit = True
+            offset += length
+        return hit
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _run_poll(self):
+        last = self._signature()
+        while not self._stop.wait(self.poll_interval):
+            signature = self._signature()
+            if signature == last:
+                continue
+            #Wait for a write in progress to finish
+            while not self._stop.wait(SETTLE_TIME):
+                settled = self._signature()
+                if settled == signature:
+                    break
+                signature = settled
+            last = signature
+            if signature is not None:
+                self._changed()
@@ -1,110 +1,327 @@
 import json
+import threading
 
 import vgamepad as vg
 
+from src.InputFrame import InputFrame
+from src.LatencyTrace import STAGE_GAMEPAD
 from src.ReadFile import resource_path
-from src.XboxMapper.Mapper import apply_control
+from src.XboxMapper.ConfigWatcher import ConfigWatcher
+from src.XboxMapper.GamepadReport import GamepadReport
+from src.XboxMapper.InputWatchdog import InputWatchdog
+from src.XboxMapper.MacroEngine import MacroEngine
+from src.XboxMapper.MappingPlan import compile_mapping
+from src.XboxMapper.OutputScheduler import OutputScheduler
+from src.XboxMapper.ProfileStore import DEFAULT_PROFILE, PROFILES_DIR, ProfileStore
 
 CONFIG_PATH = resource_path("config.cfg")
+STALE_DECAY_TIME = 0.15
 
 
 class GamepadManager:
-    def __init__(self, config_path = CONFIG_PATH):
-        self.gamepad = vg.VX360Gamepad()
+    def __init__(self, config_path = CONFIG_PATH, gamepad = None, output_rate_hz = None, stale_timeout = None,
+                 profiles_dir = PROFILES_DIR):
+        self.gamepad = gamepad if gamepad is not None else vg.VX360Gamepad()
         self.config_path = config_path
         self.mapping = {}
+        #Plans write into self.report, _applied mirrors what the driver was last sent
+        self.report = GamepadReport()
+        self._applied = GamepadReport()
         self.active_events = set()
+        self._last_inputs = None
+        self.updates_issued = 0
+        self.updates_skipped = 0
+        #Held while a frame or event is written to the report, the output scheduler thread flushes it
+        self._lock = threading.Lock()
+        self.scheduler = None
+        #Macros and pulsed events share one timer thread instead of a task and a sleep each
+        self.macros = MacroEngine(self.report, self._lock, self._flush_direct)
+        self.macros.start()
+        self.plan = compile_mapping(self.mapping, self.report, self.macros)
+        self.tracer = None
+        #Failsafe for a phone that goes quiet mid press: after stale_timeout seconds without a frame
+        #buttons are released and axes fade to neutral, the next frame restores everything
+        self.watchdog = None
+        self.stale_timeout = None
+        self.stale_decay_time = STALE_DECAY_TIME
+        self.stalls = 0
+        self._last_input_at = None
+        self._stale_since = None
+        self._stale_axes = None
+        self.config_watcher = None
+        self._config_bytes = None
+        #config.cfg is the "default" profile, named profiles are compiled against the same report
+        self.profiles = ProfileStore(self._compile_checked, profiles_dir)
+        self.active_profile = DEFAULT_PROFILE
+        self._default = None
         self.reload_mapping()
+        if output_rate_hz:
+            self.start_output_scheduler(output_rate_hz)
+        if stale_timeout:
+            self.start_watchdog(stale_timeout)
+
+    def start_output_scheduler(self, rate_hz = 250):
+        #Decouple driver reports from BLE notification timing, one report per tick with the newest frame
+        self.stop_output_scheduler()
+        self.scheduler = OutputScheduler(self._tick, rate_hz)
+        self.scheduler.start()
+
+    def stop_output_scheduler(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+
+    def start_watchdog(self, timeout = 0.5, decay_time = STALE_DECAY_TIME):
+        self.stop_watchdog()
+        self.stale_timeout = timeout
+        self.stale_decay_time = decay_time
+        self.watchdog = InputWatchdog(self._check_stale, rate_hz=max(20, 4 / timeout))
+        self.watchdog.start()
+
+    def stop_watchdog(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self.watchdog = None
+
+    def _check_stale(self, now):
+        last = self._last_input_at
+        if last is None or now - last < self.stale_timeout:
+            return
+        with self._lock:
+            if self._last_input_at is not last:
+                return      # a frame arrived while we waited for the lock
+            report = self.report
+            if self._stale_since != last:
+                self._stale_since = last
+                self._stale_axes = (report.left_trigger, report.right_trigger, report.left_joystick, report.right_joystick)
+                self.stalls += 1
+                print(f"No input for {now - last:.2f}s, returning controller to neutral")
+                report.buttons = 0
+                #Macros and pulsed events stop too, a held turbo would otherwise keep firing
+                self.macros.neutral(self.plan.macros)
+                self.active_events.clear()
+                #Every control is re-applied from the next frame, whatever it is
+                self._last_inputs = None
+            elif self._stale_axes is None:
+                return      # already neutral
+
+            left_trigger, right_trigger, (lx, ly), (rx, ry) = self._stale_axes
+            remaining = 1.0 - (now - last - self.stale_timeout) / self.stale_decay_time if self.stale_decay_time else 0.0
+            if remaining <= 0.0:
+                remaining = 0.0
+                self._stale_axes = None
+            report.left_trigger = left_trigger * remaining
+            report.right_trigger = right_trigger * remaining
+            report.left_joystick = (lx * remaining, ly * remaining)
+            report.right_joystick = (rx * remaining, ry * remaining)
+            if self.scheduler is None:
+                self._flush()
+
+    def _tick(self, frame):
+        with self._lock:
+            if frame is not None:
+                self._apply_frame(frame)
+            self._flush()
+        if frame is not None:
+            self._trace(frame)
 
     def reload_mapping(self):
-        #Keeps the current mapping if the file is missing or invalid
+        """Load, compile and validate config.cfg, then swap it in; the current plan stays on any error.
+
+        Parsing and compiling happen on the calling thread, frames only ever wait for the swap itself.
+        """
         try:
             with open(self.config_path, "rb") as f:
-                self.mapping = json.loads(f.read())
-        except (OSError, json.JSONDecodeError) as e:
+                raw = f.read()
+        except OSError as e:
             print(f"Could not load config from {self.config_path}: {e}")
+            return False
+        if raw == self._config_bytes:
+            return False    # saved again without changes, or already loaded through config_saved
+        try:
+            mapping = json.loads(raw)
+            plan = self._compile_checked(mapping)
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError, KeyError) as e:
+            print(f"Rejected config {self.config_path}, keeping the current mapping: {e}")
+            return False
+
+        self._default = (mapping, plan)
+        with self._lock:
+            self._config_bytes = raw
+            if self.active_profile == DEFAULT_PROFILE:
+                self._install(mapping, plan)
+        self._preload_targets(plan)
+        return True
+
+    def _compile_checked(self, mapping):
+        #Dry run into a scratch report first, so a mapping that only fails once it runs is rejected here
+        scratch = compile_mapping(mapping, GamepadReport())
+        for handler in scratch.handlers:
+            handler({})
+        return compile_mapping(mapping, self.report, self.macros)
+
+    def _install(self, mapping, plan):
+        #Caller holds self._lock
+        self.macros.cancel_all(self.plan.macros)
+        self.mapping = mapping
+        self.plan = plan
+        self.report.reset()         # controls the new mapping no longer drives go back to neutral
+        last = self._last_inputs
+        if last is None:
+            return
+        #Re-apply the inputs held right now, the driver goes straight from the old mapping to the new one
+        for handler in plan.handlers:
+            handler(last)
+        if self.scheduler is None:
+            self._flush()
+
+    def _profile_entry(self, name):
+        return self._default if name == DEFAULT_PROFILE else self.profiles.get(name)
+
+    def switch_profile(self, name):
+        """Swap to an already compiled profile, O(1) with no file access. Returns False if it is not loaded yet."""
+        entry = self._profile_entry(name)
+        if entry is None:
+            return False
+        with self._lock:
+            self._install(*entry)
+            self.active_profile = name
+        print(f"Switched to profile {name}")
+        self._preload_targets(entry[1])
+        return True
+
+    def load_profile(self, name):
+        #Blocking, parses and compiles the profile if needed; call it off the BLE path
+        if name != DEFAULT_PROFILE:
+            self.profiles.load(name)
+        return self.switch_profile(name)
+
+    def _preload_targets(self, plan):
+        #Profiles this plan can switch to get compiled in the background, so a mapped switch never parses
+        missing = [name for _, name in plan.profile_triggers
+                   if name != DEFAULT_PROFILE and self.profiles.get(name) is None]
+        if missing:
+            threading.Thread(target=self.profiles.preload, args=(missing,), name="ProfilePreload", daemon=True).start()
+
+    def close(self):
+        """Stop every worker thread and leave the virtual pad at neutral, pending timed actions never fire."""
+        self.stop_output_scheduler()
+        self.stop_watchdog()
+        self.stop_config_watcher()
+        self.macros.stop()
+        with self._lock:
+            self.macros.neutral(self.plan.macros)
+            self.active_events.clear()
+            self.report.reset()
+            self._last_inputs = None
+            self._flush()
+
+    def start_config_watcher(self):
+        #Edits from any tool are picked up, compiled on the watcher thread and swapped in
+        self.stop_config_watcher()
+        self.config_watcher = ConfigWatcher(self.config_path, lambda path: self.reload_mapping())
+        self.config_watcher.start()
+
+    def stop_config_watcher(self):
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+            self.config_watcher = None
 
     def set_event(self, input_key, active):
+        with self._lock:
+            self._set_event(input_key, active)
+            self._flush_direct()
+
+    def pulse_event(self, input_key, hold = 0.1):
+        #Hold an event for `hold` seconds, the release is a timer on the macro engine
+        with self._lock:
+            self._set_event(input_key, True)
+            self._flush_direct()
+        self.macros.schedule(hold, self._set_event, input_key, False)
+
+    def _set_event(self, input_key, active):
+        #Caller holds self._lock
         if active:
             self.active_events.add(input_key)
         else:
             self.active_events.discard(input_key)
 
-        for action_name, button_cfg in self.mapping.items():
-            if action_name.endswith("_joystick") or action_name.endswith("_trigger"):
-                continue
-            if not button_cfg:
-                continue
-            cfgs = button_cfg if isinstance(button_cfg, list) else [button_cfg]
-            if any(c.get("input") == input_key for c in cfgs):
-                apply_control(self.gamepad, action_name, pressed=active)
-        self.gamepad.update()
-
-    def update_state(self, input_json):
-        try:
-            state = json.loads(input_json)
-        except json.decoder.JSONDecodeError:
+        inputs = dict(self._last_inputs or {})
+        inputs[input_key] = active
+        for handler in self.plan.by_input.get(input_key, ()):
+            handler(inputs)
+        if self._last_inputs is not None:
+            self._last_inputs = inputs
+
+    def update_state(self, frame):
+        if isinstance(frame, str):
+            frame = InputFrame.from_json(frame)
+            if frame is None:
+                return
+
+        self._last_input_at = frame.received_at
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.submit(frame)
             return
+        with self._lock:
+            self._apply_frame(frame)
+            self._flush()
+        self._trace(frame)
+
+    def _trace(self, frame):
+        tracer = self.tracer
+        if tracer is not None and tracer.enabled:
+            tracer.record(STAGE_GAMEPAD, frame.received_at)
+
+    def _apply_frame(self, frame):
+        #The frame's flat lookup is shared with other consumers, only copy it when filters or pulsed events change it
+        plan = self.plan
+        inputs = frame.inputs
+        if plan.filters is not None:
+            #Smoothed and quantized floats stop changing on sensor noise, so their controls stay clean
+            inputs = plan.filters.apply(inputs, frame.received_at)
+        if self.active_events:
+            if plan.filters is None:
+                inputs = dict(inputs)
+            for event_key in self.active_events:      # keep pulsed events held
+                inputs[event_key] = True
+
+        last = self._last_inputs
+        if last is None:
+            for handler in plan.handlers:
+                handler(inputs)
+        else:
+            #Only re-run the controls that read an input which changed since the last frame
+            dirty = set()
+            for key in plan.input_keys:
+                if inputs.get(key) != last.get(key):
+                    dirty.update(plan.by_input[key])
+            for handler in dirty:
+                handler(inputs)
+        self._last_inputs = inputs
+
+        for input_key, name in plan.profile_triggers:
+            if inputs.get(input_key) and not (last and last.get(input_key)):
+                entry = self._profile_entry(name)
+                if entry is None:
+                    print(f"Profile {name} is not loaded yet")
+                    continue
+                self._install(*entry)
+                self.active_profile = name
+                print(f"Switched to profile {name}")
+                self._preload_targets(entry[1])
+                break
+
+    def _flush_direct(self):
+        #With an output scheduler the next tick sends the report
+        if self.scheduler is None:
+            self._flush()
 
-        #Make a flat dictionary for easy lookup, State dictionary has buttons in an array, looping through an array every time is inefficient
-        inputs = {}
-        for button in state.get("buttons", []):
-            inputs[f"toggle:{button['name']}"] = button["pressed"]
-        inputs["toggle:stepping"] = True if state.get("stepping") else False
-        inputs["float:pitch"] = state.get("pitch",0.0)
-        inputs["float:roll"] = state.get("roll",0.0)
-
-        for event_key in self.active_events:      # keep pulsed events held
-            inputs[event_key] = True
-
-        #Search for left and right joysticks in mapping configuration
-        #Get value of x and y through user-defined or from sensor data
-        for side in ("left","right"):
-            joystick_cfg = self.mapping.get(f"{side}_joystick")
-            if not joystick_cfg:
-                continue
-            x = self.resolve_input(joystick_cfg.get("x"), inputs) or 0.0
-            y = self.resolve_input(joystick_cfg.get("y"), inputs) or 0.0
-            apply_control(self.gamepad, f"{side}_joystick", x=x, y=y)
-
-        #Search for left and right trigger joysticks in mapping configuration
-        #Get value of press through user-defined value.
-        for side in ("left", "right"):
-            trigger_cfg = self.mapping.get(f"{side}_trigger")
-            if not trigger_cfg:
-                continue
-            value = self.resolve_input(trigger_cfg,inputs) or 0.0
-            apply_control(self.gamepad,f"{side}_trigger", value = value)
-
-        #Remaining buttons, get button state and apply gamepad control
-        for action_name, button_cfg in self.mapping.items():
-            if action_name.endswith("_joystick") or action_name.endswith("_trigger"):
-                continue
-            if not button_cfg:
-                continue
-            if isinstance(button_cfg, list):
-                pressed = any(inputs.get(cfg["input"]) for cfg in button_cfg)
-            else:
-                input_key = button_cfg["input"]
-                pressed = bool(inputs.get(input_key))
-            if pressed is not None:
-                apply_control(self.gamepad, action_name, pressed=bool(pressed))
-        self.gamepad.update()
-
-    def resolve_input(self, mapping, inputs):
-        if isinstance(mapping, list):
-            return sum(self.resolve_input(m, inputs) or 0.0 for m in
-                       mapping)  # loop through all inputs in the mapped action and sum up
-
-        if mapping is None:
-            return None
-
-        raw = inputs.get(mapping["input"])
-        if raw is None:
-            return None
-
-        if mapping["input"].startswith("toggle:"):
-            return mapping.get("value", 1.0) if raw else 0.0
+    def _flush(self):
+        #Only touch the driver for fields that changed, and skip the update round trip when nothing did
+        if self.report.apply_to(self.gamepad, self._applied):
+            self.gamepad.update()
+            self.updates_issued += 1
         else:
-            scale = mapping.get("scale", 1.0)
-            return -float(raw) / scale
+            self.updates_skipped += 1
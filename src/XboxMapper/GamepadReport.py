@@ -0,0 +1,106 @@
+class GamepadReport:
+    """The controller state a mapping wants, recorded with the same setters as vg.VX360Gamepad.
+
+    Mapping plans write into a report instead of the driver; `apply_to` then pushes only the
+    fields that differ from the last report the driver actually received. The overlay fields hold
+    what timed actions (macros, pulses) press on top of the mapping and are combined at apply time.
+    """
+    __slots__ = ("buttons", "left_trigger", "right_trigger", "left_joystick", "right_joystick", "_button_enums",
+                 "overlay_buttons", "overlay_left_trigger", "overlay_right_trigger")
+
+    def __init__(self):
+        self.buttons = 0
+        self.left_trigger = 0.0
+        self.right_trigger = 0.0
+        self.left_joystick = (0.0, 0.0)
+        self.right_joystick = (0.0, 0.0)
+        self._button_enums = {}
+        self.overlay_buttons = 0
+        self.overlay_left_trigger = 0.0
+        self.overlay_right_trigger = 0.0
+
+    def press_button(self, button):
+        bit = int(button)
+        self._button_enums[bit] = button
+        self.buttons |= bit
+
+    def release_button(self, button):
+        bit = int(button)
+        self._button_enums[bit] = button
+        self.buttons &= ~bit
+
+    def left_trigger_float(self, value_float):
+        self.left_trigger = value_float
+
+    def right_trigger_float(self, value_float):
+        self.right_trigger = value_float
+
+    def left_joystick_float(self, x_value_float, y_value_float):
+        self.left_joystick = (x_value_float, y_value_float)
+
+    def right_joystick_float(self, x_value_float, y_value_float):
+        self.right_joystick = (x_value_float, y_value_float)
+
+    def overlay_button(self, button, pressed):
+        bit = int(button)
+        self._button_enums[bit] = button
+        if pressed:
+            self.overlay_buttons |= bit
+        else:
+            self.overlay_buttons &= ~bit
+
+    def overlay_trigger(self, side, value):
+        if side == "left":
+            self.overlay_left_trigger = value
+        else:
+            self.overlay_right_trigger = value
+
+    def reset(self):
+        self.buttons = 0
+        self.left_trigger = 0.0
+        self.right_trigger = 0.0
+        self.left_joystick = (0.0, 0.0)
+        self.right_joystick = (0.0, 0.0)
+
+    def apply_to(self, gamepad, applied):
+        """Call the driver setters for fields that differ from `applied`, then record them there.
+
+        Returns True if anything was sent and gamepad.update() is needed.
+        """
+        changed = False
+
+        buttons = self.buttons | self.overlay_buttons
+        diff = buttons ^ applied.buttons
+        if diff:
+            for bit, button in self._button_enums.items():
+                if diff & bit:
+                    if buttons & bit:
+                        gamepad.press_button(button=button)
+                    else:
+                        gamepad.release_button(button=button)
+            applied.buttons = buttons
+            changed = True
+
+        left_trigger = max(self.left_trigger, self.overlay_left_trigger)
+        if left_trigger != applied.left_trigger:
+            gamepad.left_trigger_float(value_float=left_trigger)
+            applied.left_trigger = left_trigger
+            changed = True
+        right_trigger = max(self.right_trigger, self.overlay_right_trigger)
+        if right_trigger != applied.right_trigger:
+            gamepad.right_trigger_float(value_float=right_trigger)
+            applied.right_trigger = right_trigger
+            changed = True
+
+        if self.left_joystick != applied.left_joystick:
+            x, y = self.left_joystick
+            gamepad.left_joystick_float(x_value_float=x, y_value_float=y)
+            applied.left_joystick = self.left_joystick
+            changed = True
+        if self.right_joystick != applied.right_joystick:
+            x, y = self.right_joystick
+            gamepad.right_joystick_float(x_value_float=x, y_value_float=y)
+            applied.right_joystick = self.right_joystick
+            changed = True
+
+        return changed
@@ -0,0 +1,134 @@
+import math
+
+# Optional "filters" section of config.cfg, keyed by float input:
+#   "filters": {
+#       "float:pitch": {
+#           "smoothing": {"type": "one_euro", "min_cutoff": 1.0, "beta": 0.05},   or {"type": "ema", "alpha": 0.3}
+#           "deadzone": 0.05,       # radians around rest that read as exactly 0
+#           "curve": 1.5,           # response exponent, > 1 is finer near the centre
+#           "quantize": 0.005,      # snap to steps so sensor noise stops changing the value
+#           "range": 1.5708         # full deflection, deadzone and curve are relative to it
+#       }
+#   }
+# Stages run in that order: smoothing, deadzone, curve, quantize.
+DEFAULT_RANGE = math.pi / 2
+FILTER_KEYS = {"smoothing", "deadzone", "curve", "quantize", "range"}
+
+
+class FilterStage:
+    """Every configured float filter compiled into one pass over the frame.
+
+    `apply` returns a copy of the inputs with the filtered values, the frame itself is shared with
+    other consumers and is never modified.
+    """
+    __slots__ = ("keys", "_filters")
+
+    def __init__(self, filters):
+        self._filters = tuple(filters)
+        self.keys = tuple(key for key, _ in self._filters)
+
+    def apply(self, inputs, at):
+        filtered = dict(inputs)
+        for key, run in self._filters:
+            raw = inputs.get(key)
+            if raw is not None:
+                filtered[key] = run(float(raw), at)
+        return filtered
+
+
+def _ema(alpha):
+    state = [None]
+
+    def run(x, at):
+        previous = state[0]
+        value = x if previous is None else previous + alpha * (x - previous)
+        state[0] = value
+        return value
+    return run
+
+
+def _one_euro(min_cutoff, beta, d_cutoff):
+    #Casiez et al.: heavy smoothing while the phone is still, little lag while it moves quickly
+    state = [None, 0.0, 0.0]    # last value, last derivative, last time
+
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def run(x, at):
+        previous, derivative, last_at = state
+        if previous is None or at <= last_at:
+            state[0], state[2] = x, at
+            return x if previous is None else previous
+        dt = at - last_at
+        derivative += alpha(d_cutoff, dt) * ((x - previous) / dt - derivative)
+        cutoff = min_cutoff + beta * abs(derivative)
+        value = previous + alpha(cutoff, dt) * (x - previous)
+        state[0], state[1], state[2] = value, derivative, at
+        return value
+    return run
+
+
+def _compile_one(key, cfg):
+    unknown = set(cfg) - FILTER_KEYS
+    if unknown:
+        raise ValueError(f"Unknown filter settings for {key}: {', '.join(sorted(unknown))}")
+
+    full = float(cfg.get("range", DEFAULT_RANGE))
+    if full <= 0:
+        raise ValueError(f"Filter range for {key} must be positive")
+
+    smooth = None
+    smoothing = cfg.get("smoothing")
+    if smoothing:
+        kind = smoothing.get("type", "ema")
+        if kind == "ema":
+            alpha = float(smoothing.get("alpha", 0.5))
+            if not 0 < alpha <= 1:
+                raise ValueError(f"EMA alpha for {key} must be in (0, 1]")
+            smooth = _ema(alpha)
+        elif kind == "one_euro":
+            smooth = _one_euro(float(smoothing.get("min_cutoff", 1.0)), float(smoothing.get("beta", 0.0)),
+                               float(smoothing.get("d_cutoff", 1.0)))
+        else:
+            raise ValueError(f"Unknown smoothing type for {key}: {kind}")
+
+    deadzone = float(cfg.get("deadzone") or 0.0)
+    if not 0 <= deadzone < full:
+        raise ValueError(f"Deadzone for {key} must be between 0 and its range")
+    curve = float(cfg.get("curve") or 1.0)
+    if curve <= 0:
+        raise ValueError(f"Curve for {key} must be positive")
+    step = float(cfg.get("quantize") or 0.0)
+    #Deadzone rescales what is left so the output still reaches full deflection without a jump
+    live = full - deadzone
+
+    def run(x, at):
+        if smooth is not None:
+            x = smooth(x, at)
+        magnitude = abs(x)
+        if deadzone:
+            if magnitude <= deadzone:
+                return 0.0
+            magnitude = (magnitude - deadzone) / live * full
+        if curve != 1.0:
+            magnitude = min(magnitude / full, 1.0) ** curve * full
+        if step:
+            magnitude = round(magnitude / step) * step
+        return magnitude if x >= 0 else -magnitude
+    return run
+
+
+def compile_filters(config):
+    """Build a FilterStage from the "filters" section, or None when nothing is filtered."""
+    if not config:
+        return None
+    if not isinstance(config, dict):
+        raise ValueError("filters must map input names to filter settings")
+    filters = []
+    for key, cfg in config.items():
+        if not key.startswith("float:"):
+            raise ValueError(f"Only float inputs can be filtered, got {key}")
+        if cfg:
+            filters.append((key, _compile_one(key, cfg)))
+    return FilterStage(filters) if filters else None
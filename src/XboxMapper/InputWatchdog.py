@@ -0,0 +1,39 @@
+import threading
+import time
+
+
+class InputWatchdog:
+    """Calls `check(now)` a few times a second from its own thread.
+
+    The input path only stores the arrival time of each frame; deciding that input has gone stale
+    happens here, off the BLE callback, so a silent phone costs nothing per frame.
+    """
+
+    def __init__(self, check, rate_hz=20):
+        self.check = check
+        self.period = 1.0 / rate_hz
+        self.checks = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="InputWatchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            try:
+                self.check(time.perf_counter())
+            except Exception as e:
+                print(f"Input watchdog check failed: {e}")
+            self.checks += 1
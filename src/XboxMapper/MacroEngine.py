@@ -0,0 +1,276 @@
+import math
+import threading
+import time
+
+from src.XboxMapper.Mapper import GAMEPAD_ACTIONS, ActionType
+
+# Optional "macros" section of config.cfg:
+#   "macros": {
+#       "hadouken": {"trigger": "toggle:Special", "steps": [
+#           {"press": "dpad_down", "hold": 0.05},
+#           {"press": ["dpad_down", "dpad_right"], "hold": 0.05},
+#           {"press": ["dpad_right", "X"], "hold": 0.05, "wait": 0.1}]},
+#       "dodge": {"trigger": ["toggle:L", "toggle:R"], "press": "B", "hold": 0.2},
+#       "rapid_fire": {"trigger": "toggle:Fire", "turbo": "A", "rate_hz": 15}
+#   }
+# A list of triggers is a chord, every input has to be held. Sequences and holds run to the end once
+# started, turbo repeats for as long as the trigger is held. Targets are gamepad buttons or triggers.
+TICK = 0.005
+WHEEL_SLOTS = 256
+DEFAULT_HOLD = 0.05
+SEQUENCE = "sequence"
+TURBO = "turbo"
+
+
+class TimerWheel:
+    """Hashed timer wheel: scheduling is O(1) and each tick only looks at one slot.
+
+    Times are whole ticks; delays longer than one revolution stay in their slot until their tick comes round.
+    """
+
+    def __init__(self, slots=WHEEL_SLOTS):
+        self.slots = [[] for _ in range(slots)]
+        self.current = 0
+        self.pending = 0
+
+    def add(self, due_tick, entry):
+        self.slots[due_tick % len(self.slots)].append((due_tick, entry))
+        self.pending += 1
+
+    def advance(self, to_tick):
+        #Returns the entries due up to and including to_tick
+        if not self.pending:
+            self.current = max(self.current, to_tick)
+            return []
+        due = []
+        count = len(self.slots)
+        while self.current < to_tick and self.pending:
+            self.current += 1
+            index = self.current % count
+            bucket = self.slots[index]
+            if not bucket:
+                continue
+            keep = []
+            for item in bucket:
+                if item[0] <= self.current:
+                    due.append(item[1])
+                else:
+                    keep.append(item)
+            self.slots[index] = keep
+            self.pending -= len(bucket) - len(keep)
+        self.current = max(self.current, to_tick)
+        return due
+
+
+class Macro:
+    """One compiled macro plus its run state. `generation` invalidates timers of a cancelled run."""
+    __slots__ = ("name", "kind", "steps", "targets", "half_period", "held", "generation", "pressed")
+
+    def __init__(self, name, kind, steps=(), targets=(), half_period=0.0):
+        self.name = name
+        self.kind = kind
+        self.steps = steps
+        self.targets = targets
+        self.half_period = half_period
+        self.held = False
+        self.generation = 0
+        self.pressed = []
+
+
+class MacroEngine:
+    """Runs every timed gamepad action (macros, pulsed events) on one thread with one timer wheel.
+
+    start/stop/cancel_all and the press helpers are called with the GamepadManager lock held; timers fire
+    on the engine thread, which takes that lock around each batch and then calls `flush`.
+    """
+
+    def __init__(self, report, lock, flush, tick=TICK):
+        self.report = report
+        self.lock = lock
+        self.flush = flush
+        self.tick = tick
+        self.fired = 0
+        self.scheduled = 0
+        self._wheel = TimerWheel()
+        self._wheel_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._start = time.perf_counter()
+        self._button_counts = {}
+        self._trigger_counts = {"left": 0, "right": 0}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def schedule(self, delay, callback, *args):
+        #Safe from any thread; delays round up to the next tick
+        due = int((time.perf_counter() - self._start) / self.tick) + max(1, math.ceil(delay / self.tick))
+        with self._wheel_lock:
+            self._wheel.add(due, (callback, args))
+            self.scheduled += 1
+        self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="MacroEngine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+        #Timers still pending are dropped, nothing fires once the engine is stopped
+        with self._wheel_lock:
+            self._wheel = TimerWheel()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._wheel_lock:
+                idle = not self._wheel.pending
+            if idle:
+                #Nothing scheduled, sleep until schedule() wakes us
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            now_tick = int((time.perf_counter() - self._start) / self.tick)
+            with self._wheel_lock:
+                due = self._wheel.advance(now_tick)
+            if due:
+                with self.lock:
+                    for callback, args in due:
+                        try:
+                            callback(*args)
+                        except Exception as e:
+                            print(f"Timed gamepad action failed: {e}")
+                    self.fired += len(due)
+                    self.flush()
+            next_tick = self._start + (now_tick + 1) * self.tick
+            self._stop.wait(max(0.0, next_tick - time.perf_counter()))
+
+    #Macro runs, all called with the GamepadManager lock held
+
+    def trigger(self, macro, active):
+        if active == macro.held:
+            return
+        macro.held = active
+        if active:
+            self._cancel(macro)
+            if macro.kind == TURBO:
+                self._turbo(macro, macro.generation, True)
+            else:
+                self._step(macro, macro.generation, 0)
+        elif macro.kind == TURBO:
+            self._cancel(macro)
+
+    def cancel_all(self, macros):
+        for macro in macros:
+            macro.held = False
+            self._cancel(macro)
+
+    def neutral(self, macros):
+        #Failsafe: every macro stopped and nothing left on the overlay, whatever pressed it
+        self.cancel_all(macros)
+        self._button_counts.clear()
+        self._trigger_counts = {"left": 0, "right": 0}
+        self.report.overlay_buttons = 0
+        self.report.overlay_left_trigger = 0.0
+        self.report.overlay_right_trigger = 0.0
+
+    def _cancel(self, macro):
+        macro.generation += 1
+        self._release_all(macro)
+
+    def _step(self, macro, generation, index):
+        if generation != macro.generation or index >= len(macro.steps):
+            return
+        targets, hold, wait = macro.steps[index]
+        for target in targets:
+            self._press(macro, target)
+        self.schedule(hold, self._end_step, macro, generation, index, wait)
+
+    def _end_step(self, macro, generation, index, wait):
+        if generation != macro.generation:
+            return
+        self._release_all(macro)
+        if wait:
+            self.schedule(wait, self._step, macro, generation, index + 1)
+        else:
+            self._step(macro, generation, index + 1)
+
+    def _turbo(self, macro, generation, on):
+        if generation != macro.generation:
+            return
+        if on:
+            for target in macro.targets:
+                self._press(macro, target)
+        else:
+            self._release_all(macro)
+        self.schedule(macro.half_period, self._turbo, macro, generation, not on)
+
+    def _press(self, macro, target):
+        kind, value = target
+        if kind == ActionType.BUTTON:
+            count = self._button_counts.get(value, 0)
+            self._button_counts[value] = count + 1
+            if count == 0:
+                self.report.overlay_button(value, True)
+        else:
+            self._trigger_counts[value] += 1
+            self.report.overlay_trigger(value, 1.0)
+        macro.pressed.append(target)
+
+    def _release_all(self, macro):
+        for kind, value in macro.pressed:
+            if kind == ActionType.BUTTON:
+                count = self._button_counts[value] - 1
+                self._button_counts[value] = count
+                if count == 0:
+                    self.report.overlay_button(value, False)
+            else:
+                self._trigger_counts[value] -= 1
+                if self._trigger_counts[value] == 0:
+                    self.report.overlay_trigger(value, 0.0)
+        macro.pressed = []
+
+
+def _targets(name, cfg):
+    names = cfg if isinstance(cfg, list) else [cfg]
+    targets = []
+    for action in names:
+        control = GAMEPAD_ACTIONS.get(action)
+        if control is None or control[0] not in (ActionType.BUTTON, ActionType.TRIGGER):
+            raise ValueError(f"Macro {name}: {action!r} is not a gamepad button or trigger")
+        targets.append(control)
+    return tuple(targets)
+
+
+def compile_macro(name, cfg):
+    """Returns (trigger input keys, Macro), raises ValueError for a malformed definition."""
+    trigger = cfg.get("trigger")
+    keys = tuple(trigger if isinstance(trigger, list) else [trigger]) if trigger else ()
+    if not keys or not all(isinstance(key, str) for key in keys):
+        raise ValueError(f"Macro {name} needs a trigger input")
+
+    if "turbo" in cfg:
+        rate = float(cfg.get("rate_hz", 10))
+        if rate <= 0:
+            raise ValueError(f"Macro {name}: rate_hz must be positive")
+        return keys, Macro(name, TURBO, targets=_targets(name, cfg["turbo"]), half_period=0.5 / rate)
+
+    raw_steps = cfg.get("steps")
+    if raw_steps is None and "press" in cfg:
+        raw_steps = [{"press": cfg["press"], "hold": cfg.get("hold", DEFAULT_HOLD)}]
+    if not raw_steps:
+        raise ValueError(f"Macro {name} needs steps, press or turbo")
+    steps = []
+    for step in raw_steps:
+        targets = _targets(name, step["press"]) if step.get("press") else ()
+        hold = float(step.get("hold", DEFAULT_HOLD if targets else 0.0))
+        wait = float(step.get("wait", 0.0))
+        if hold < 0 or wait < 0:
+            raise ValueError(f"Macro {name}: hold and wait cannot be negative")
+        steps.append((targets, hold, wait))
+    return keys, Macro(name, SEQUENCE, steps=tuple(steps))
@@ -61,7 +61,13 @@ def config_to_rows(config: dict) -> dict:
     return rows
 
 
-def rows_to_config(rows: dict) -> dict:
+def extra_sections(config: dict) -> dict:
+    # Sections the row editor does not show (e.g. "filters"), carried through a save untouched
+    row_keys = {key for key, *_ in XBOX_CONTROLS if key not in JOYSTICK_KEYS} | {"left_joystick", "right_joystick"}
+    return {key: value for key, value in config.items() if key not in row_keys}
+
+
+def rows_to_config(rows: dict, extra: dict = None) -> dict:
     config = {}
 
     def serialize_chip(chip):
@@ -93,4 +99,6 @@ def rows_to_config(rows: dict) -> dict:
             jcfg[axis] = serialize_chips(rows.get(k, []))
         config[f"{side}_joystick"] = jcfg
 
+    if extra:
+        config.update(extra)
     return config
\ No newline at end of file
@@ -0,0 +1,142 @@
+from src.XboxMapper.InputFilters import compile_filters
+from src.XboxMapper.MacroEngine import compile_macro
+from src.XboxMapper.Mapper import GAMEPAD_ACTIONS, ActionType
+
+PROFILE_ACTION = "profile:"
+
+
+class MappingPlan:
+    """A config.cfg mapping compiled into handlers that are ready to run every frame.
+
+    `by_input` maps each phone input key to the handlers that read it, so a frame only
+    re-evaluates the gamepad controls whose inputs changed. `filters` is the optional
+    FilterStage float inputs go through first, `profile_triggers` holds (input key, profile name)
+    pairs from "profile:<name>" actions and `macros` the Macros of the "macros" section.
+    """
+    __slots__ = ("handlers", "by_input", "input_keys", "filters", "profile_triggers", "macros")
+
+    def __init__(self, handlers, by_input, filters=None, profile_triggers=(), macros=()):
+        self.handlers = handlers
+        self.by_input = by_input
+        self.input_keys = tuple(by_input)
+        self.filters = filters
+        self.profile_triggers = profile_triggers
+        self.macros = macros
+
+
+def _sources(cfg):
+    #Flatten a single entry or a list of entries into (input key, is toggle, scale, value) tuples
+    if not cfg:
+        return ()
+    cfgs = cfg if isinstance(cfg, list) else [cfg]
+    sources = []
+    for c in cfgs:
+        if not c or not c.get("input"):
+            continue
+        key = c["input"]
+        value = c.get("value")
+        sources.append((key, key.startswith("toggle:"), float(c.get("scale") or 1.0), 1.0 if value is None else float(value)))
+    return tuple(sources)
+
+
+def _resolve(sources, inputs):
+    #Sum every input mapped to the axis, toggles give their value while held, floats are scaled sensor data
+    total = 0.0
+    for key, is_toggle, scale, value in sources:
+        raw = inputs.get(key)
+        if raw is None:
+            continue
+        if is_toggle:
+            if raw:
+                total += value
+        else:
+            total -= float(raw) / scale
+    return total
+
+
+def _button_handler(press, release, button, keys):
+    def apply(inputs):
+        for key in keys:
+            if inputs.get(key):
+                press(button=button)
+                return
+        release(button=button)
+    return apply
+
+
+def _trigger_handler(set_trigger, sources):
+    def apply(inputs):
+        set_trigger(value_float=_resolve(sources, inputs))
+    return apply
+
+
+def _joystick_handler(set_joystick, x_sources, y_sources):
+    def apply(inputs):
+        set_joystick(x_value_float=_resolve(x_sources, inputs), y_value_float=_resolve(y_sources, inputs))
+    return apply
+
+
+def _macro_handler(trigger, macro, keys):
+    def apply(inputs):
+        for key in keys:
+            if not inputs.get(key):
+                trigger(macro, False)
+                return
+        trigger(macro, True)
+    return apply
+
+
+def compile_mapping(mapping, gamepad, macro_engine=None):
+    """Compile a mapping dict into a MappingPlan bound to `gamepad`'s setters.
+
+    Macros are always validated but only get handlers when there is a `macro_engine` to run them.
+    """
+    handlers = []
+    by_input = {}
+    profile_triggers = []
+    macros = []
+
+    def add(handler, sources):
+        handlers.append(handler)
+        for source in sources:
+            by_input.setdefault(source[0], []).append(handler)
+
+    for action_name, cfg in mapping.items():
+        if action_name.startswith(PROFILE_ACTION) and cfg:
+            #Pressing the input switches to that profile instead of driving a gamepad control
+            profile_triggers.extend((source[0], action_name[len(PROFILE_ACTION):]) for source in _sources(cfg))
+            continue
+        control = GAMEPAD_ACTIONS.get(action_name)
+        if control is None or not cfg:
+            continue
+        action_type, target = control
+
+        if action_type == ActionType.BUTTON:
+            sources = _sources(cfg)
+            if sources:
+                keys = tuple(s[0] for s in sources)
+                add(_button_handler(gamepad.press_button, gamepad.release_button, target, keys), sources)
+
+        elif action_type == ActionType.TRIGGER:
+            sources = _sources(cfg)
+            setter = gamepad.left_trigger_float if target == "left" else gamepad.right_trigger_float
+            add(_trigger_handler(setter, sources), sources)
+
+        elif action_type == ActionType.JOYSTICK:
+            x_sources = _sources(cfg.get("x"))
+            y_sources = _sources(cfg.get("y"))
+            setter = gamepad.left_joystick_float if target == "left" else gamepad.right_joystick_float
+            add(_joystick_handler(setter, x_sources, y_sources), x_sources + y_sources)
+
+    macro_config = mapping.get("macros") or {}
+    if not isinstance(macro_config, dict):
+        raise ValueError("macros must map macro names to their definitions")
+    for name, cfg in macro_config.items():
+        keys, macro = compile_macro(name, cfg)
+        macros.append(macro)
+        if macro_engine is not None:
+            #A chord re-checks every one of its inputs, so it is registered under each of them
+            add(_macro_handler(macro_engine.trigger, macro, keys), tuple((key,) for key in keys))
+
+    return MappingPlan(tuple(handlers), {key: tuple(hs) for key, hs in by_input.items()},
+                       compile_filters(mapping.get("filters")), tuple(profile_triggers), tuple(macros))
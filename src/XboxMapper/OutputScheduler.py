@@ -0,0 +1,71 @@
+import threading
+import time
+
+
+class OutputScheduler:
+    """Pushes gamepad reports at a fixed rate from its own thread.
+
+    BLE callbacks only `submit()` the newest frame; whatever is latest when a tick fires
+    gets applied, so bursts of notifications collapse into one driver report per tick.
+    """
+
+    def __init__(self, tick, rate_hz=250):
+        self.tick = tick
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.ticks = 0
+        self.tick_overruns = 0
+        self.submitted_frames = 0
+        self.applied_frames = 0
+        self._pending = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def coalesced_frames(self):
+        #Frames that were replaced by a newer one before a tick picked them up
+        return self.submitted_frames - self.applied_frames
+
+    def submit(self, frame):
+        #Called from the BLE callback, a single attribute store so it never blocks on the tick thread
+        self._pending = frame
+        self.submitted_frames += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="GamepadOutput", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def _run(self):
+        last_frame = None
+        next_tick = time.perf_counter()
+        while not self._stop.is_set():
+            frame = self._pending
+            if frame is last_frame:
+                frame = None
+            else:
+                last_frame = frame
+                self.applied_frames += 1
+            try:
+                self.tick(frame)
+            except Exception as e:
+                print(f"Gamepad output tick failed: {e}")
+            self.ticks += 1
+
+            next_tick += self.period
+            now = time.perf_counter()
+            if now > next_tick:
+                #Missed the slot, count it and realign instead of bursting to catch up
+                self.tick_overruns += 1
+                next_tick = now
+            else:
+                time.sleep(next_tick - now)
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from src.ReadFile import resource_path
+
+PROFILES_DIR = resource_path("profiles")
+PROFILE_SUFFIX = ".cfg"
+# {"<layout sha256>": "<profile name>"}, which profile to switch to when that layout is sent to the phone
+INDEX_FILE = "index.json"
+DEFAULT_PROFILE = "default"
+
+
+class ProfileStore:
+    """A directory of named mappings (`<name>.cfg`, same format as config.cfg).
+
+    Names come from the directory listing and layouts from index.json, so nothing is parsed until a
+    profile is first loaded. Compiled plans are kept in an LRU of `capacity` entries; `get` on a
+    cached profile is a dictionary lookup, `load` does the parsing and is meant for off the hot path.
+    """
+
+    def __init__(self, compile_plan, directory=PROFILES_DIR, capacity=8):
+        self.directory = directory
+        self.compile_plan = compile_plan
+        self.capacity = capacity
+        self.names = set()
+        self.by_layout = {}
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        #get() runs on the BLE path, load() on worker threads
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        try:
+            entries = os.listdir(self.directory)
+        except OSError:
+            entries = []
+        self.names = {entry[:-len(PROFILE_SUFFIX)] for entry in entries if entry.endswith(PROFILE_SUFFIX)}
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                self.by_layout = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.by_layout = {}
+        with self._lock:
+            for name in list(self._plans):
+                if name not in self.names:
+                    del self._plans[name]
+
+    def path(self, name):
+        if not name or os.path.basename(name) != name or name.startswith("."):
+            raise ValueError(f"Invalid profile name: {name!r}")
+        return os.path.join(self.directory, name + PROFILE_SUFFIX)
+
+    def get(self, name):
+        """(mapping, plan) if `name` is compiled and cached, otherwise None. Never touches the disk."""
+        with self._lock:
+            entry = self._plans.get(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(name)
+            self.hits += 1
+            return entry
+
+    def load(self, name):
+        """Parse and compile `name`, cache it and return (mapping, plan). Raises KeyError or ValueError."""
+        entry = self.get(name)
+        if entry is not None:
+            return entry
+        if name not in self.names:
+            self.refresh()
+            if name not in self.names:
+                raise KeyError(f"No profile named {name!r} in {self.directory}")
+        with open(self.path(name), "rb") as f:
+            mapping = json.loads(f.read())
+        entry = (mapping, self.compile_plan(mapping))
+        with self._lock:
+            self._plans[name] = entry
+            self._plans.move_to_end(name)
+            while len(self._plans) > self.capacity:
+                self._plans.popitem(last=False)
+        return entry
+
+    def preload(self, names):
+        for name in names:
+            try:
+                self.load(name)
+            except (OSError, KeyError, ValueError, TypeError, AttributeError) as e:
+                print(f"Could not preload profile {name}: {e}")
+
+    def profile_for_layout(self, layout_hash):
+        return self.by_layout.get(layout_hash)
+
+    def bind_layout(self, layout_hash, name):
+        self.path(name)
+        self.by_layout[layout_hash] = name
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, INDEX_FILE), "w") as f:
+            json.dump(self.by_layout, f, indent=4)
+
+    def save(self, name, mapping):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(name), "w") as f:
+            json.dump(mapping, f, indent=4)
+        self.names.add(name)
+        with self._lock:
+            self._plans.pop(name, None)